@@ -1,36 +1,114 @@
+from __future__ import annotations
+
 import os
 import io
+import gc
+import atexit
 import json
-import pickle
-from datetime import date, timedelta, datetime
+import time
+import uuid
+import hashlib
+import random
+import socket
+import tempfile
+import unicodedata
+import functools
+import threading
+import contextlib
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Iterator
+from datetime import date, timedelta, datetime, timezone
 
-import pandas as pd
 from dateutil import parser
 from flask import (
     Flask, render_template, request, redirect, url_for,
-    flash, session, send_file
+    flash, session, send_file, g
 )
+from google.auth.exceptions import RefreshError
 from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event as sa_event
+from sqlalchemy.exc import TimeoutError as SATimeoutError
+from sqlalchemy.pool import QueuePool
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from google_auth_oauthlib.flow import Flow
+
+
+# =========================
+# NẠP THƯ VIỆN NẶNG KHI CẦN
+# =========================
+# pandas, openpyxl, googleapiclient.discovery, google_auth_oauthlib và openai tốn
+# hàng trăm ms + vài chục MB mỗi worker; phần lớn request không cần tới nên chỉ import ở lần dùng đầu.
+@functools.lru_cache(maxsize=None)
+def _pandas():
+    import pandas
+    return pandas
+
+
+@functools.lru_cache(maxsize=None)
+def _numpy():
+    import numpy
+    return numpy
+
+
+@functools.lru_cache(maxsize=None)
+def _load_workbook():
+    from openpyxl import load_workbook
+    return load_workbook
+
+
+@functools.lru_cache(maxsize=None)
+def _build_from_document():
+    from googleapiclient.discovery import build_from_document
+    return build_from_document
+
+
+@functools.lru_cache(maxsize=None)
+def _flow_class():
+    from google_auth_oauthlib.flow import Flow
+    return Flow
+
 
 # ==== OpenAI (API v1.x) ====
-try:
-    from openai import OpenAI
-    _OPENAI_AVAILABLE = True
-except Exception:
-    _OPENAI_AVAILABLE = False
-    OpenAI = None  # type: ignore
+@functools.lru_cache(maxsize=None)
+def _openai_class():
+    """Lớp client OpenAI, None nếu chưa cài SDK."""
+    try:
+        from openai import OpenAI
+    except Exception:
+        return None
+    return OpenAI
 
 
 def _openai_client_or_none():
     """Khởi tạo client OpenAI nếu có API key hợp lệ."""
     api_key = os.getenv("OPENAI_API_KEY", "")
-    if not _OPENAI_AVAILABLE or not api_key:
+    if not api_key:
+        return None
+    OpenAI = _openai_class()
+    if OpenAI is None:
         return None
+    kwargs = {}
+    if TRACING_ENABLED:
+        # Hook của httpx đếm từng lần gửi (kể cả retry của SDK) vào span hiện tại
+        from openai import DefaultHttpxClient
+        kwargs["http_client"] = DefaultHttpxClient(event_hooks={
+            "request": [_count_openai_request], "response": [_count_openai_response],
+        })
     try:
-        return OpenAI(api_key=api_key)
+        # Mỗi lời gọi đã có deadline riêng (QUIZ_LLM_TIMEOUT, QUIZ_FEEDBACK_TIMEOUT); retry mặc định
+        # của SDK (2 lần) sẽ giữ thread của pool tới ~3 lần deadline sau khi trang đã dùng fallback
+        return OpenAI(api_key=api_key, max_retries=0, **kwargs)
     except Exception:
         return None
 
@@ -55,21 +133,151 @@ SCOPES = [
     "openid",
 ]
 CREDENTIALS_FILE = "credentials.json"
-GOOGLE_ENABLED = os.path.exists(CREDENTIALS_FILE)
+# Gán lại trong init_oauth() khi tạo app
+GOOGLE_ENABLED = False
 
 # =========================
 # DATABASE CONFIG
 # =========================
-DATABASE_URL = os.getenv("DATABASE_URL")
-if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql+psycopg://", 1)
-else:
-    DATABASE_URL = DATABASE_URL or "sqlite:///local.db"
+db = SQLAlchemy()
 
-app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-db = SQLAlchemy(app)
-print("✅ DATABASE_URL in use:", DATABASE_URL)
+
+def database_url() -> str:
+    url = os.getenv("DATABASE_URL")
+    if url and url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql+psycopg://", 1)
+    if url and url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+psycopg://", 1)
+    return url or "sqlite:///local.db"
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool đo thời gian chờ lấy kết nối (gồm cả mở kết nối mới) vào metrics."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except SATimeoutError:
+            DB_POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            DB_POOL_WAIT.observe(time.perf_counter() - start)
+
+
+# Profile SQLite cho triển khai một node: WAL (đọc không chặn ghi), synchronous=NORMAL
+# (an toàn với WAL, bớt fsync mỗi commit), mmap và busy timeout để worker chờ khoá thay vì
+# báo "database is locked". SQLITE_TUNED=0 để quay về cấu hình mặc định.
+SQLITE_TUNED = os.getenv("SQLITE_TUNED", "1") == "1"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "5"))
+SQLITE_POOL_OVERFLOW = int(os.getenv("SQLITE_POOL_OVERFLOW", "5"))
+
+
+def is_sqlite_file(url: str) -> bool:
+    return url.startswith("sqlite") and ":memory:" not in url and not url.rstrip("/").endswith("sqlite:")
+
+
+def sqlite_engine_options() -> dict:
+    # Pool có giới hạn: mỗi process giữ tối đa SQLITE_POOL_SIZE + SQLITE_POOL_OVERFLOW kết nối
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": SQLITE_POOL_SIZE,
+        "max_overflow": SQLITE_POOL_OVERFLOW,
+        "pool_timeout": 30,
+        "connect_args": {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+    }
+
+
+def _sqlite_on_connect(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+# Postgres (psycopg 3): mỗi worker gunicorn có pool riêng nên ngân sách kết nối của cả node
+# (PG_MAX_CONNECTIONS, chừa lại phần của max_connections cho admin/migration) chia theo số worker.
+# WEB_CONCURRENCY/WEB_THREADS là số worker/thread gunicorn (gunicorn.conf.py đọc cùng biến).
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+WEB_THREADS = int(os.getenv("WEB_THREADS", "1"))
+PG_MAX_CONNECTIONS = int(os.getenv("PG_MAX_CONNECTIONS", "90"))
+PG_POOL_RECYCLE = int(os.getenv("PG_POOL_RECYCLE", "1800"))
+PG_POOL_TIMEOUT = float(os.getenv("PG_POOL_TIMEOUT", "10"))
+# psycopg tự PREPARE phía server một câu lệnh khi nó chạy đủ số lần này trên một kết nối (mặc định của
+# psycopg là 5). Để trống thì giữ mặc định; đặt "off" khi đi qua PgBouncer chế độ transaction
+# (không hỗ trợ prepared statement).
+# PG_TUNED=0 để quay về cấu hình pool mặc định của SQLAlchemy.
+PG_TUNED = os.getenv("PG_TUNED", "1") == "1"
+PG_PREPARE_THRESHOLD = os.getenv("PG_PREPARE_THRESHOLD", "")
+
+
+def postgres_engine_options() -> dict:
+    per_worker = max(2, PG_MAX_CONNECTIONS // WEB_CONCURRENCY)
+    # Thường trực: thread request + vài kết nối cho thread nền; lúc cao điểm các pool nền
+    # (import, quiz, đồng bộ lịch, làm mới token) dùng phần overflow
+    pool_size = int(os.getenv("PG_POOL_SIZE", str(min(per_worker, WEB_THREADS + 2))))
+    demand = WEB_THREADS + IMPORT_WORKERS + QUIZ_WORKERS + EVENT_SYNC_WORKERS + TOKEN_REFRESH_WORKERS
+    max_overflow = int(os.getenv("PG_POOL_OVERFLOW", str(max(0, min(per_worker, demand) - pool_size))))
+    connect_args = {}
+    if PG_PREPARE_THRESHOLD:
+        off = PG_PREPARE_THRESHOLD.lower() in ("off", "none")
+        connect_args["prepare_threshold"] = None if off else int(PG_PREPARE_THRESHOLD)
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": PG_POOL_TIMEOUT,
+        "pool_recycle": PG_POOL_RECYCLE,
+        # Kết nối chết (Postgres restart, idle timeout) bị thay trước khi trả cho request
+        "pool_pre_ping": True,
+        "connect_args": connect_args,
+    }
+
+
+def _pool_connect(dbapi_connection, connection_record):
+    DB_CONNECTIONS_OPENED.inc()
+
+
+def _pool_checkout(dbapi_connection, connection_record, connection_proxy):
+    DB_POOL_CHECKED_OUT.inc()
+
+
+def _pool_checkin(dbapi_connection, connection_record):
+    DB_POOL_CHECKED_OUT.dec()
+
+
+_pool_warmed = False
+_pool_warm_lock = threading.Lock()
+
+
+def _warm_db_pool():
+    """Mở sẵn pool_size kết nối để request đầu tiên không phải chờ bắt tay TCP/TLS/auth."""
+    with app.app_context():
+        pool = db.engine.pool
+        try:
+            conns = [db.engine.connect() for _ in range(pool.size())]
+            for conn in conns:
+                conn.close()
+        except Exception as e:
+            print(f"⚠️ Không mở sẵn được kết nối DB: {e}")
+
+
+@app.before_request
+def _ensure_db_pool_warm():
+    global _pool_warmed
+    if _pool_warmed:
+        return
+    with _pool_warm_lock:
+        if _pool_warmed:
+            return
+        _pool_warmed = True
+    if not (PG_TUNED and app.config["SQLALCHEMY_DATABASE_URI"].startswith("postgresql")):
+        return
+    threading.Thread(target=_warm_db_pool, name="db-pool-warm", daemon=True).start()
 
 
 # =========================
@@ -79,6 +287,325 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(255), unique=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_seen = db.Column(db.DateTime, index=True)
+
+
+class Credential(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expiry = db.Column(db.DateTime, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    refresh_claimed_at = db.Column(db.DateTime)
+
+
+class Event(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    google_id = db.Column(db.String(255), nullable=False)
+    summary = db.Column(db.String(500))
+    start = db.Column(db.DateTime, nullable=False)
+    end = db.Column(db.DateTime, nullable=False)
+    data = db.Column(db.Text, nullable=False)
+    import_key = db.Column(db.String(64))
+    import_hash = db.Column(db.String(64))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index("ix_event_user_start", "user_id", "start"),
+        db.Index("ix_event_user_import_key", "user_id", "import_key"),
+        db.UniqueConstraint("user_id", "google_id", name="uq_event_user_google"),
+    )
+
+
+class CalendarSync(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    sync_token = db.Column(db.Text)
+    synced_at = db.Column(db.Float, default=0.0)
+
+
+class Completion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (db.Index("ix_completion_user_day", "user_id", "day"),)
+
+
+class DailyStat(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    completed = db.Column(db.Integer, default=0, nullable=False)
+
+
+class UserStats(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    streak = db.Column(db.Integer, default=0, nullable=False)
+    best_streak = db.Column(db.Integer, default=0, nullable=False)
+    last_day = db.Column(db.Date)
+    total_points = db.Column(db.Integer, default=0, nullable=False)
+    total_completions = db.Column(db.Integer, default=0, nullable=False)
+
+
+class QuizAttempt(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    email = db.Column(db.String(255), index=True)
+    topic = db.Column(db.String(255))
+    status = db.Column(db.String(16), default="pending")
+    quiz = db.Column(db.Text)
+    score = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    submitted_at = db.Column(db.DateTime)
+
+
+class QuizCache(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    topic_key = db.Column(db.String(255), index=True, nullable=False)
+    quiz = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class ImportJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    email = db.Column(db.String(255), index=True)
+    status = db.Column(db.String(16), default="queued")
+    total = db.Column(db.Integer, default=0)
+    done = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    skipped = db.Column(db.Integer, default=0)
+    message = db.Column(db.Text)
+    # File tạm đang chờ xử lý và worker ("host:pid") giữ job trong hàng đợi bộ nhớ
+    path = db.Column(db.Text)
+    worker = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# =========================
+# TRACING LỜI GỌI RA NGOÀI (GOOGLE, OPENAI)
+# =========================
+# Mỗi request là một span SERVER; lời gọi Google/OpenAI trong request là span CLIENT con.
+# Span được gom rồi xuất dạng OTLP/JSON: ghi từng dòng vào TRACE_EXPORT_FILE và/hoặc
+# POST tới collector TRACE_OTLP_ENDPOINT (vd. http://localhost:4318/v1/traces). Không đặt gì thì tắt.
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE", "")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")
+TRACING_ENABLED = bool(TRACE_EXPORT_FILE or TRACE_OTLP_ENDPOINT)
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "5"))
+TRACE_BATCH_SIZE = 512
+SPAN_KIND_INTERNAL, SPAN_KIND_SERVER, SPAN_KIND_CLIENT = 1, 2, 3
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, kind: int, parent: Span | None):
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else ""
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes: dict = {}
+        self.error = ""
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def add(self, key: str, n: int):
+        self.attributes[key] = self.attributes.get(key, 0) + n
+
+    def fail(self, message: str):
+        self.error = message
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        attempts = self.attributes.get("http.attempts")
+        if attempts:
+            self.attributes["retries"] = attempts - 1
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    def set(self, key: str, value):
+        pass
+
+    def add(self, key: str, n: int):
+        pass
+
+    def fail(self, message: str):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar("current_span", default=None)
+
+
+def _otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def current_span() -> Span | _NoopSpan:
+    return _current_span.get() or _NOOP_SPAN
+
+
+@contextlib.contextmanager
+def trace_span(name: str, kind: int = SPAN_KIND_CLIENT, **attributes):
+    """Đo một lời gọi; exception bay qua được ghi thành trạng thái lỗi của span."""
+    if not TRACING_ENABLED:
+        yield _NOOP_SPAN
+        return
+    span = Span(name, kind, _current_span.get())
+    span.attributes.update(attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+        span_exporter.add(span)
+
+
+class SpanExporter:
+    """Gom span trong bộ nhớ, thread nền xuất theo lô mỗi TRACE_FLUSH_INTERVAL giây."""
+
+    def __init__(self):
+        self.spans: list[Span] = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.started = False
+        self.exported = 0
+        self.dropped = 0
+
+    def add(self, span: Span):
+        with self.lock:
+            self.spans.append(span)
+            if not self.started:
+                self.started = True
+                threading.Thread(target=self._loop, name="span-exporter", daemon=True).start()
+            if len(self.spans) >= TRACE_BATCH_SIZE:
+                self.wakeup.set()
+
+    def _loop(self):
+        while True:
+            self.wakeup.wait(TRACE_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            spans, self.spans = self.spans, []
+        if not spans:
+            return
+        payload = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [
+                _otlp_attribute("service.name", os.getenv("OTEL_SERVICE_NAME", "student-coach")),
+                _otlp_attribute("process.pid", os.getpid()),
+            ]},
+            "scopeSpans": [{"scope": {"name": "app"}, "spans": [s.to_otlp() for s in spans]}],
+        }]}, ensure_ascii=False)
+        try:
+            if TRACE_EXPORT_FILE:
+                with open(TRACE_EXPORT_FILE, "a", encoding="utf-8") as f:
+                    f.write(payload + "\n")
+            if TRACE_OTLP_ENDPOINT:
+                import requests as http_requests
+                http_requests.post(TRACE_OTLP_ENDPOINT, data=payload.encode(),
+                                   headers={"Content-Type": "application/json"}, timeout=5).raise_for_status()
+            self.exported += len(spans)
+        except Exception as e:
+            self.dropped += len(spans)
+            print(f"⚠️ Không xuất được {len(spans)} span: {e}")
+
+
+span_exporter = SpanExporter()
+atexit.register(span_exporter.flush)
+
+
+@app.before_request
+def _trace_start():
+    if TRACING_ENABLED:
+        span = Span(f"{request.method} {request.endpoint or 'not_found'}", SPAN_KIND_SERVER, None)
+        span.set("http.method", request.method)
+        span.set("http.route", request.url_rule.rule if request.url_rule else "")
+        g.trace = (span, _current_span.set(span))
+
+
+@app.teardown_request
+def _trace_finish(exc):
+    if "trace" not in g:
+        return
+    span, token = g.pop("trace")
+    _current_span.reset(token)
+    if exc is not None:
+        span.error = f"{type(exc).__name__}: {exc}"
+    span.end()
+    span_exporter.add(span)
+
+
+@app.after_request
+def _trace_status(response):
+    if "trace" in g:
+        span = g.trace[0]
+        span.set("http.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.error = f"HTTP {response.status_code}"
+    return response
+
+
+def traced_http(credentials):
+    """http cho googleapiclient: đếm số lần gửi (retry) và số byte vào span hiện tại."""
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.http import build_http
+
+    http = AuthorizedHttp(credentials, http=build_http())
+    send = http.request
+
+    def request(uri, method="GET", body=None, *args, **kwargs):
+        span = current_span()
+        span.add("http.attempts", 1)
+        span.add("http.request_bytes", len(body or b""))
+        resp, content = send(uri, method, body, *args, **kwargs)
+        span.add("http.response_bytes", len(content or b""))
+        span.set("http.status_code", resp.status)
+        return resp, content
+
+    http.request = request
+    return http
+
+
+def _count_openai_request(req):
+    span = current_span()
+    span.add("http.attempts", 1)
+    span.add("http.request_bytes", len(req.content or b""))
+
+
+def _count_openai_response(resp):
+    span = current_span()
+    span.set("http.status_code", resp.status_code)
+    span.add("http.response_bytes", int(resp.headers.get("content-length") or 0))
 
 
 # =========================
@@ -93,46 +620,772 @@ def _redirect_base() -> str:
     return f"{host}/oauth2callback"
 
 
+# credentials.json được parse một lần và giữ trong bộ nhớ; mỗi CLIENT_CONFIG_CHECK_INTERVAL giây
+# mới stat() lại file một lần để tự nạp lại khi file thay đổi
+CLIENT_CONFIG_CHECK_INTERVAL = float(os.getenv("CLIENT_CONFIG_CHECK_INTERVAL", "5"))
+_client_config: dict | None = None
+_client_config_mtime: int | None = None
+_client_config_checked = 0.0
+_client_config_lock = threading.Lock()
+
+
+def oauth_client_config() -> dict | None:
+    """Client config OAuth đã parse sẵn, None nếu chưa có credentials.json."""
+    global _client_config, _client_config_mtime, _client_config_checked
+    if time.monotonic() - _client_config_checked < CLIENT_CONFIG_CHECK_INTERVAL:
+        return _client_config
+    with _client_config_lock:
+        now = time.monotonic()
+        if now - _client_config_checked < CLIENT_CONFIG_CHECK_INTERVAL:
+            return _client_config
+        _client_config_checked = now
+        try:
+            mtime = os.stat(CREDENTIALS_FILE).st_mtime_ns
+        except OSError:
+            # File tạm thời biến mất (đang deploy/ghi đè): giữ config cũ
+            return _client_config
+        if mtime != _client_config_mtime:
+            try:
+                with open(CREDENTIALS_FILE, encoding="utf-8") as f:
+                    _client_config = json.load(f)
+                _client_config_mtime = mtime
+                print("🔑 Đã nạp OAuth client config từ", CREDENTIALS_FILE)
+            except (OSError, ValueError) as e:
+                # File đang ghi dở: lần kiểm tra sau sẽ đọc lại
+                print(f"⚠️ Không đọc được {CREDENTIALS_FILE}: {e}")
+        return _client_config
+
+
 def build_flow(redirect_uri: str, state: str | None = None) -> Flow | None:
-    if not GOOGLE_ENABLED:
+    config = oauth_client_config() if GOOGLE_ENABLED else None
+    if config is None:
         return None
-    flow = Flow.from_client_secrets_file(CREDENTIALS_FILE, scopes=SCOPES, redirect_uri=redirect_uri)
+    flow = _flow_class().from_client_config(config, scopes=SCOPES, redirect_uri=redirect_uri)
     if state:
         flow.oauth2session._state = state
     return flow
 
 
-def get_token_filename(email: str | None) -> str:
-    safe_email = (email or "anonymous").replace("@", "_").replace(".", "_")
-    return f"token_{safe_email}.pickle"
+# Credential lưu dạng JSON trong DB, có LRU trong process phía trước
+CREDENTIAL_CACHE_SIZE = int(os.getenv("CREDENTIAL_CACHE_SIZE", "1024"))
+_credential_cache: OrderedDict = OrderedDict()
+_credential_cache_lock = threading.Lock()
 
 
-def get_google_calendar_service():
-    if not GOOGLE_ENABLED:
+def _remember_credentials(email: str, creds: Credentials):
+    with _credential_cache_lock:
+        _credential_cache[email] = creds
+        _credential_cache.move_to_end(email)
+        while len(_credential_cache) > CREDENTIAL_CACHE_SIZE:
+            _credential_cache.popitem(last=False)
+
+
+def credentials_from_json(data: str) -> Credentials:
+    info = json.loads(data)
+    # to_json() bỏ refresh_token khi không có, nhưng from_authorized_user_info bắt buộc key này
+    info.setdefault("refresh_token", None)
+    return Credentials.from_authorized_user_info(info, SCOPES)
+
+
+def _forget_credentials(email: str):
+    with _credential_cache_lock:
+        _credential_cache.pop(email, None)
+
+
+def load_credentials(email: str) -> Credentials | None:
+    with _credential_cache_lock:
+        creds = _credential_cache.get(email)
+        # Token hết hạn trong cache có thể đã được node/worker khác làm mới: đọc lại DB
+        if creds is not None and creds.valid:
+            _credential_cache.move_to_end(email)
+            return creds
+    row = (
+        db.session.query(Credential)
+        .join(User, User.id == Credential.user_id)
+        .filter(User.email == email)
+        .first()
+    )
+    if not row:
         return None
+    creds = credentials_from_json(row.data)
+    _remember_credentials(email, creds)
+    return creds
+
+
+def save_credentials(email: str, creds: Credentials):
+    user = User.query.filter_by(email=email).first()
+    if not user:
+        user = User(email=email)
+        db.session.add(user)
+        db.session.flush()
+    user.last_seen = datetime.utcnow()
+    row = db.session.get(Credential, user.id) or Credential(user_id=user.id)
+    row.data = creds.to_json()
+    row.expiry = creds.expiry
+    row.updated_at = datetime.utcnow()
+    db.session.add(row)
+    db.session.commit()
+    _remember_credentials(email, creds)
+
+
+# =========================
+# LÀM MỚI TOKEN NỀN
+# =========================
+# Làm mới token trước khi hết hạn TOKEN_REFRESH_MARGIN giây, quét mỗi TOKEN_REFRESH_INTERVAL giây
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "300"))
+TOKEN_REFRESH_INTERVAL = int(os.getenv("TOKEN_REFRESH_INTERVAL", "60"))
+TOKEN_REFRESH_WORKERS = int(os.getenv("TOKEN_REFRESH_WORKERS", "2"))
+# Một worker "giữ" credential trong khoảng này để các worker/node khác không làm mới trùng
+TOKEN_REFRESH_LEASE = 120
+# Chỉ làm mới trước cho user có request trong khoảng này; user quay lại sau đó được làm mới khi cần
+TOKEN_REFRESH_ACTIVE_WINDOW = int(os.getenv("TOKEN_REFRESH_ACTIVE_WINDOW", str(24 * 3600)))
+# User.last_seen được ghi tối đa một lần mỗi LAST_SEEN_WRITE_INTERVAL giây mỗi worker
+LAST_SEEN_WRITE_INTERVAL = int(os.getenv("LAST_SEEN_WRITE_INTERVAL", "300"))
+_refresh_executor = ThreadPoolExecutor(max_workers=TOKEN_REFRESH_WORKERS, thread_name_prefix="token-refresh")
+_refresher_started = False
+_refresher_lock = threading.Lock()
+
+
+def _count_refresh(outcome: str):
+    TOKEN_REFRESHES.labels(outcome).inc()
+
+
+def _claim_credential(user_id: int) -> Credential | None:
+    """Giữ credential bằng một UPDATE có điều kiện; trả về row nếu giữ được."""
+    now = datetime.utcnow()
+    claimed = (
+        db.session.query(Credential)
+        .filter(Credential.user_id == user_id)
+        .filter(
+            (Credential.refresh_claimed_at.is_(None))
+            | (Credential.refresh_claimed_at < now - timedelta(seconds=TOKEN_REFRESH_LEASE))
+        )
+        .update({Credential.refresh_claimed_at: now}, synchronize_session=False)
+    )
+    db.session.commit()
+    return db.session.get(Credential, user_id) if claimed else None
+
+
+def refresh_credential(user_id: int):
+    """Làm mới token của một user rồi ghi lại, chỉ khi chưa có ai ghi đè trong lúc làm mới."""
+    with app.app_context():
+        try:
+            row = _claim_credential(user_id)
+            if not row:
+                _count_refresh("skipped")
+                return
+            data, updated_at = row.data, row.updated_at
+            creds = credentials_from_json(data)
+            if not creds.refresh_token:
+                # Không thể làm mới; giữ lease để không bị quét lại liên tục
+                _count_refresh("skipped")
+                return
+            try:
+                with trace_span("oauth.refresh"):
+                    creds.refresh(Request())
+            except RefreshError as e:
+                if "invalid_grant" not in str(e):
+                    raise
+                # Token bị thu hồi/hết hiệu lực: không thử lại nữa, lần sau user đăng nhập lại
+                print(f"⚠️ Token user {user_id} không còn hiệu lực, xoá credential: {e}")
+                db.session.delete(row)
+                db.session.commit()
+                user = db.session.get(User, user_id)
+                if user and user.email:
+                    _forget_credentials(user.email)
+                _count_refresh("revoked")
+                return
+            except Exception as e:
+                print(f"⚠️ Không làm mới được token user {user_id}: {e}")
+                row.refresh_claimed_at = None
+                db.session.commit()
+                _count_refresh("failed")
+                return
+            written = (
+                db.session.query(Credential)
+                .filter(Credential.user_id == user_id, Credential.updated_at == updated_at)
+                .update({
+                    Credential.data: creds.to_json(),
+                    Credential.expiry: creds.expiry,
+                    Credential.updated_at: datetime.utcnow(),
+                    Credential.refresh_claimed_at: None,
+                }, synchronize_session=False)
+            )
+            db.session.commit()
+            if written:
+                user = db.session.get(User, user_id)
+                if user and user.email:
+                    _remember_credentials(user.email, creds)
+                _count_refresh("performed")
+            else:
+                _count_refresh("skipped")
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️ Lỗi khi làm mới token user {user_id}: {e}")
+            _count_refresh("failed")
+        finally:
+            db.session.remove()
+
+
+def request_token_refresh(email: str):
+    """Yêu cầu làm mới token của `email` ở thread nền, không chờ kết quả."""
+    user = User.query.filter_by(email=email).first()
+    if user:
+        _refresh_executor.submit(refresh_credential, user.id)
+
+
+def _refresh_expiring_tokens():
+    with app.app_context():
+        now = datetime.utcnow()
+        horizon = now + timedelta(seconds=TOKEN_REFRESH_MARGIN)
+        active_since = now - timedelta(seconds=TOKEN_REFRESH_ACTIVE_WINDOW)
+        user_ids = [
+            user_id for (user_id,) in
+            db.session.query(Credential.user_id)
+            .join(User, User.id == Credential.user_id)
+            .filter(Credential.expiry < horizon, User.last_seen >= active_since)
+        ]
+        db.session.remove()
+    for user_id in user_ids:
+        _refresh_executor.submit(refresh_credential, user_id)
+
+
+def _token_refresher_loop():
+    while True:
+        try:
+            _refresh_expiring_tokens()
+        except Exception as e:
+            print(f"⚠️ Token refresher lỗi: {e}")
+        time.sleep(TOKEN_REFRESH_INTERVAL)
+
+
+def start_token_refresher():
+    global _refresher_started
+    with _refresher_lock:
+        if _refresher_started or not GOOGLE_ENABLED:
+            return
+        _refresher_started = True
+    threading.Thread(target=_token_refresher_loop, name="token-refresher", daemon=True).start()
+
+
+@app.before_request
+def _ensure_token_refresher():
+    if not _refresher_started:
+        start_token_refresher()
+
+
+_last_seen_written: OrderedDict = OrderedDict()
+
+
+@app.before_request
+def _touch_last_seen():
     email = session.get("google_email")
     if not email:
+        return
+    now = time.monotonic()
+    with _credential_cache_lock:
+        written = _last_seen_written.get(email)
+        if written is not None and now - written < LAST_SEEN_WRITE_INTERVAL:
+            return
+        _last_seen_written[email] = now
+        _last_seen_written.move_to_end(email)
+        while len(_last_seen_written) > CREDENTIAL_CACHE_SIZE:
+            _last_seen_written.popitem(last=False)
+    try:
+        User.query.filter_by(email=email).update({User.last_seen: datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ Không ghi được last_seen ({email}): {e}")
+
+
+# Tài liệu discovery tĩnh (đi kèm googleapiclient) chỉ parse một lần mỗi process
+# GOOGLE_API_ROOT trỏ mọi API Google sang máy chủ khác (vd. bench/fake_google.py khi load test)
+GOOGLE_API_ROOT = os.getenv("GOOGLE_API_ROOT", "")
+
+
+@functools.lru_cache(maxsize=None)
+def discovery_doc(api: str, version: str) -> dict:
+    doc = json.loads(get_static_doc(api, version))
+    if GOOGLE_API_ROOT:
+        doc["rootUrl"] = GOOGLE_API_ROOT.rstrip("/") + "/"
+    return doc
+
+
+def build_service(api: str, version: str, credentials):
+    if TRACING_ENABLED:
+        return _build_from_document()(discovery_doc(api, version), http=traced_http(credentials))
+    return _build_from_document()(discovery_doc(api, version), credentials=credentials)
+
+
+# Cache service Calendar theo (email, hạn token, thread), LRU + TTL. httplib2.Http của service
+# không an toàn giữa các thread nên mỗi thread request (gunicorn --threads) có bản riêng.
+SERVICE_CACHE_SIZE = int(os.getenv("SERVICE_CACHE_SIZE", "256"))
+SERVICE_CACHE_TTL = int(os.getenv("SERVICE_CACHE_TTL", "600"))
+_service_cache: OrderedDict = OrderedDict()
+_service_cache_lock = threading.Lock()
+
+
+def _cached_service(email: str, creds):
+    key = (email, creds.expiry, threading.get_ident())
+    now = time.monotonic()
+    with _service_cache_lock:
+        entry = _service_cache.get(key)
+        if entry and now - entry[0] < SERVICE_CACHE_TTL:
+            _service_cache.move_to_end(key)
+            current_span().set("service.cached", True)
+            return entry[1]
+    current_span().set("service.cached", False)
+    service = build_service("calendar", "v3", creds)
+    with _service_cache_lock:
+        _service_cache[key] = (now, service)
+        _service_cache.move_to_end(key)
+        while len(_service_cache) > SERVICE_CACHE_SIZE:
+            _service_cache.popitem(last=False)
+    return service
+
+
+def calendar_service_for(email: str | None, fresh: bool = False):
+    """Trả về service Calendar của `email`.
+
+    Service trong cache chỉ dùng lại trong cùng thread. `fresh=True` tạo service
+    riêng (không dùng cache), dành cho job nền chạy qua nhiều thread.
+    """
+    if not GOOGLE_ENABLED or not email:
         return None
-    token_file = get_token_filename(email)
-    creds = None
-    if os.path.exists(token_file):
-        with open(token_file, "rb") as f:
-            creds = pickle.load(f)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
+    with trace_span("calendar.service", SPAN_KIND_INTERNAL, fresh=fresh) as span:
+        creds = load_credentials(email)
+        if not creds or not creds.valid:
+            span.set("credentials.valid", False)
+            # Không chặn request để làm mới token: giao cho thread nền rồi trả None
+            if creds and creds.refresh_token:
+                request_token_refresh(email)
             return None
-    return build("calendar", "v3", credentials=creds)
+        if fresh:
+            return build_service("calendar", "v3", creds)
+        return _cached_service(email, creds)
+
+
+def get_google_calendar_service(fresh: bool = False):
+    """Service Calendar của người dùng đang đăng nhập."""
+    return calendar_service_for(session.get("google_email"), fresh=fresh)
+
+
+def google_reconnecting() -> bool:
+    """Token đã hết hạn nhưng đang được làm mới ở nền (không cần đăng nhập lại)."""
+    email = session.get("google_email")
+    creds = load_credentials(email) if GOOGLE_ENABLED and email else None
+    return bool(creds and creds.refresh_token and not creds.valid)
+
+
+# Google Calendar khuyến nghị tối đa 50 request trong một batch
+CALENDAR_BATCH_LIMIT = 50
+
+
+# =========================
+# GIỚI HẠN TỐC ĐỘ GOOGLE CALENDAR
+# =========================
+# Token bucket theo user và theo cả project; lỗi quota thì backoff có jitter và giảm tốc độ gửi (AIMD):
+# mỗi batch thành công cộng CALENDAR_AIMD_STEP request/giây (tối đa CALENDAR_USER_QPS), bị 429 thì chia đôi.
+# Bucket project nằm trong bộ nhớ từng worker nên mỗi worker chỉ giữ CALENDAR_PROJECT_QPS / WEB_CONCURRENCY;
+# chạy nhiều node thì đặt CALENDAR_PROJECT_QPS là phần quota của riêng node đó.
+CALENDAR_USER_QPS = float(os.getenv("CALENDAR_USER_QPS", "10"))
+CALENDAR_PROJECT_QPS = float(os.getenv("CALENDAR_PROJECT_QPS", "100"))
+CALENDAR_MIN_QPS = 0.5
+CALENDAR_AIMD_STEP = float(os.getenv("CALENDAR_AIMD_STEP", "1"))
+CALENDAR_MAX_RETRIES = int(os.getenv("CALENDAR_MAX_RETRIES", "5"))
+# Request đang có người chờ (dashboard, thêm lịch) chỉ retry ít lần: backoff đầy đủ có thể vượt timeout
+# 30 giây của gunicorn. Đồng bộ nền và import vẫn dùng CALENDAR_MAX_RETRIES.
+CALENDAR_REQUEST_RETRIES = int(os.getenv("CALENDAR_REQUEST_RETRIES", "1"))
+CALENDAR_BACKOFF_BASE = 0.5
+CALENDAR_BACKOFF_MAX = 32.0
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, n: int = 1):
+        """Chờ tới khi lấy được `n` token."""
+        while n > 0:
+            step = min(n, self.capacity)
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= step:
+                    self.tokens -= step
+                    n -= step
+                    continue
+                wait = (step - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def set_rate(self, rate: float, drain: bool = False):
+        """Đổi tốc độ nạp; `drain=True` bỏ phần token còn lại để không gửi dồn ngay sau đó."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = 0 if drain else min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.rate = rate
+
+
+class CalendarLimiter:
+    """Bucket của một user với tốc độ điều chỉnh theo AIMD."""
+
+    def __init__(self):
+        self.rate = CALENDAR_USER_QPS
+        self.bucket = TokenBucket(self.rate, CALENDAR_BATCH_LIMIT)
+        self.lock = threading.Lock()
 
+    def acquire(self, n: int = 1):
+        self.bucket.acquire(n)
+        _project_bucket.acquire(n)
 
-def clear_old_tokens():
-    for file in os.listdir("."):
-        if file.startswith("token_") and file.endswith(".pickle"):
+    def batch_size(self) -> int:
+        # Mỗi batch mang khoảng một giây ngân sách để tốc độ mới có hiệu lực ngay batch sau
+        return max(1, min(CALENDAR_BATCH_LIMIT, int(self.rate)))
+
+    def on_success(self):
+        with self.lock:
+            if self.rate < CALENDAR_USER_QPS:
+                self.rate = min(CALENDAR_USER_QPS, self.rate + CALENDAR_AIMD_STEP)
+                self.bucket.set_rate(self.rate)
+
+    def on_throttle(self):
+        with self.lock:
+            self.rate = max(CALENDAR_MIN_QPS, self.rate / 2)
+            self.bucket.set_rate(self.rate, drain=True)
+
+
+_project_bucket = TokenBucket(CALENDAR_PROJECT_QPS / WEB_CONCURRENCY, CALENDAR_PROJECT_QPS / WEB_CONCURRENCY)
+_calendar_limiters: dict = {}
+_calendar_limiters_lock = threading.Lock()
+
+
+def calendar_limiter(user_key) -> CalendarLimiter:
+    with _calendar_limiters_lock:
+        limiter = _calendar_limiters.get(user_key)
+        if limiter is None:
+            limiter = _calendar_limiters[user_key] = CalendarLimiter()
+        return limiter
+
+
+def is_rate_limited(exception) -> bool:
+    if not isinstance(exception, HttpError):
+        return False
+    if exception.resp.status == 429:
+        return True
+    return exception.resp.status == 403 and b"ateLimitExceeded" in (exception.content or b"")
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff với full jitter."""
+    return random.uniform(0, min(CALENDAR_BACKOFF_MAX, CALENDAR_BACKOFF_BASE * 2 ** attempt))
+
+
+def calendar_execute(request, user_key=None, retries: int = CALENDAR_MAX_RETRIES):
+    """Thực thi một request Calendar qua bộ giới hạn; googleapiclient tự retry 429/403 quota có jitter."""
+    calendar_limiter(user_key).acquire()
+    with trace_span(getattr(request, "methodId", None) or "calendar.request"):
+        return request.execute(num_retries=retries)
+
+
+def execute_batched(service, requests: list, progress=None, responses: list | None = None, user_key=None) -> tuple[int, int]:
+    """Gửi các request Calendar theo lô, trả về (số thành công, số lỗi).
+
+    Request bị từ chối vì quota được gửi lại sau backoff, tối đa
+    CALENDAR_MAX_RETRIES lần. `progress(successes, failures)` (nếu có) được
+    gọi sau mỗi batch; phản hồi của các request thành công được thêm vào
+    `responses` (nếu có).
+    """
+    limiter = calendar_limiter(user_key)
+    queue = deque((req, 0) for req in requests)
+    successes, failures = 0, 0
+    while queue:
+        chunk = [queue.popleft() for _ in range(min(limiter.batch_size(), len(queue)))]
+        limiter.acquire(len(chunk))
+        outcome = {}
+
+        def _callback(request_id, response, exception):
+            outcome[int(request_id)] = (response, exception)
+
+        batch = service.new_batch_http_request(callback=_callback)
+        for i, (req, _) in enumerate(chunk):
+            batch.add(req, request_id=str(i))
+        batch_error = None
+        with trace_span("calendar.batch", **{"batch.size": len(chunk)}) as span:
             try:
-                os.remove(file)
-            except Exception:
-                pass
+                batch.execute()
+            except Exception as e:
+                batch_error = e
+                span.fail(f"{type(e).__name__}: {e}")
+            span.set("batch.failed", sum(1 for _, exc in outcome.values() if exc is not None))
+        throttled = []
+        for i, (req, attempts) in enumerate(chunk):
+            # Request không nhận được phản hồi mang lỗi của cả batch
+            response, exception = outcome.get(i, (None, batch_error or RuntimeError("no response")))
+            if exception is None:
+                successes += 1
+                if responses is not None:
+                    responses.append(response)
+            elif is_rate_limited(exception) and attempts < CALENDAR_MAX_RETRIES:
+                throttled.append((req, attempts + 1))
+            else:
+                failures += 1
+        if throttled:
+            limiter.on_throttle()
+            time.sleep(backoff_delay(max(n for _, n in throttled)))
+            queue.extendleft(reversed(throttled))
+        else:
+            limiter.on_success()
+        if progress:
+            progress(successes, failures)
+    return successes, failures
+
+
+def insert_events_batched(service, events: list[dict], progress=None, inserted: list | None = None, user_key=None) -> tuple[int, int]:
+    """Thêm nhiều sự kiện bằng batch request, trả về (số thành công, số lỗi)."""
+    requests = [service.events().insert(calendarId="primary", body=event) for event in events]
+    return execute_batched(service, requests, progress=progress, responses=inserted, user_key=user_key)
+
+
+def update_events_batched(service, updates: list[tuple[str, dict]], progress=None, updated: list | None = None, user_key=None) -> tuple[int, int]:
+    """Sửa tại chỗ các sự kiện (google_id, body) bằng batch request."""
+    requests = [
+        service.events().patch(calendarId="primary", eventId=event_id, body=event)
+        for event_id, event in updates
+    ]
+    return execute_batched(service, requests, progress=progress, responses=updated, user_key=user_key)
+
+
+# =========================
+# KHO SỰ KIỆN LOCAL (đồng bộ từ Google bằng syncToken)
+# =========================
+# Dashboard đọc bảng Event; Google chỉ là nguồn đồng bộ, làm mới sau EVENT_SYNC_TTL giây
+EVENT_SYNC_TTL = int(os.getenv("EVENT_SYNC_TTL", "60"))
+EVENT_SYNC_WORKERS = int(os.getenv("EVENT_SYNC_WORKERS", "2"))
+# Lần đồng bộ đầu chỉ lấy sự kiện từ EVENT_SYNC_PAST_DAYS ngày trước trở đi (mặc định một học kỳ),
+# không kéo cả lịch sử nhiều năm của lịch primary. Khi import lại file, dòng cũ hơn mốc này không
+# có trong bảng Event nên không được nhận ra là đã import.
+EVENT_SYNC_PAST_DAYS = int(os.getenv("EVENT_SYNC_PAST_DAYS", "180"))
+_sync_executor = ThreadPoolExecutor(max_workers=EVENT_SYNC_WORKERS, thread_name_prefix="event-sync")
+_sync_pending: set[int] = set()
+_sync_pending_lock = threading.Lock()
+
+
+def _event_time(value: dict) -> datetime:
+    """Đổi start/end của Calendar (dateTime hoặc date cả ngày) thành datetime UTC (naive)."""
+    dt = datetime.fromisoformat(value.get("dateTime") or value["date"])
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def user_id_for(email: str | None) -> int | None:
+    if not email:
+        return None
+    row = db.session.query(User.id).filter(User.email == email).first()
+    return row[0] if row else None
+
+
+def upsert_events(user_id: int, items: list[dict]):
+    """Ghi các event Google vào bảng Event; event bị huỷ thì xoá."""
+    if not items:
+        return
+    existing = {
+        e.google_id: e for e in
+        Event.query.filter(Event.user_id == user_id, Event.google_id.in_([i["id"] for i in items]))
+    }
+    for item in items:
+        row = existing.get(item["id"])
+        if item.get("status") == "cancelled" or "start" not in item:
+            if row:
+                db.session.delete(row)
+                existing.pop(item["id"])
+            continue
+        if not row:
+            row = Event(user_id=user_id, google_id=item["id"])
+            db.session.add(row)
+            existing[item["id"]] = row
+        row.summary = (item.get("summary") or "")[:500]
+        row.start = _event_time(item["start"])
+        row.end = _event_time(item["end"])
+        row.data = json.dumps(item, ensure_ascii=False)
+        private = item.get("extendedProperties", {}).get("private", {})
+        row.import_key = private.get(IMPORT_KEY_PROP)
+        row.import_hash = private.get(IMPORT_HASH_PROP)
+        row.updated_at = datetime.utcnow()
+    db.session.commit()
+
+
+def sync_user_events(service, user_id: int):
+    """Đồng bộ Event từ Google: lần đầu lấy từ EVENT_SYNC_PAST_DAYS ngày trước, các lần sau chỉ lấy delta."""
+    state = db.session.get(CalendarSync, user_id) or CalendarSync(user_id=user_id)
+    params = {"calendarId": "primary", "singleEvents": True, "maxResults": 250}
+    if state.sync_token:
+        # Google không cho dùng timeMin cùng syncToken; delta giữ nguyên phạm vi của lần đầu
+        params["syncToken"] = state.sync_token
+    else:
+        params["timeMin"] = (datetime.utcnow() - timedelta(days=EVENT_SYNC_PAST_DAYS)).isoformat() + "Z"
+    page_token = None
+    while True:
+        try:
+            results = calendar_execute(service.events().list(pageToken=page_token, **params), user_id)
+        except HttpError as e:
+            # 410 Gone: syncToken hết hạn, phải đồng bộ lại từ đầu
+            if state.sync_token and e.resp.status == 410:
+                state.sync_token = None
+                db.session.add(state)
+                db.session.commit()
+                return sync_user_events(service, user_id)
+            raise
+        upsert_events(user_id, results.get("items", []))
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            break
+    state.sync_token = results.get("nextSyncToken")
+    state.synced_at = time.time()
+    db.session.add(state)
+    db.session.commit()
+
+
+def _run_event_sync(email: str, user_id: int):
+    with app.app_context():
+        try:
+            service = calendar_service_for(email, fresh=True)
+            if service:
+                sync_user_events(service, user_id)
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️ Đồng bộ lịch lỗi ({email}): {e}")
+        finally:
+            with _sync_pending_lock:
+                _sync_pending.discard(user_id)
+            db.session.remove()
+
+
+def request_event_sync(email: str, user_id: int):
+    """Đồng bộ ở thread nền, mỗi user tối đa một lượt đang chạy."""
+    with _sync_pending_lock:
+        if user_id in _sync_pending:
+            return
+        _sync_pending.add(user_id)
+    _sync_executor.submit(_run_event_sync, email, user_id)
+
+
+def live_upcoming_events(user_id: int, days: int = 7, limit: int = 50) -> list[dict]:
+    """Đọc thẳng từ Google (một lời gọi, như trước khi có bảng Event), dùng khi chưa đồng bộ xong."""
+    service = get_google_calendar_service()
+    if not service:
+        return []
+    now = datetime.utcnow()
+    try:
+        results = calendar_execute(service.events().list(
+            calendarId="primary",
+            timeMin=now.isoformat() + "Z",
+            timeMax=(now + timedelta(days=days)).isoformat() + "Z",
+            maxResults=limit,
+            singleEvents=True,
+            orderBy="startTime",
+        ), user_id, retries=CALENDAR_REQUEST_RETRIES)
+    except Exception as e:
+        print(f"⚠️ Không đọc được lịch từ Google (user {user_id}): {e}")
+        return []
+    return results.get("items", [])
+
+
+def upcoming_events(user_id: int, days: int = 7, limit: int = 50) -> list[dict]:
+    """Sự kiện trong `days` ngày tới, đọc từ bảng Event (index user_id, start)."""
+    now = datetime.utcnow()
+    rows = (
+        Event.query
+        .filter(
+            Event.user_id == user_id,
+            # Sự kiện đang diễn ra bắt đầu tối đa 1 ngày trước: giữ truy vấn trong khoảng index
+            Event.start >= now - timedelta(days=1),
+            Event.start < now + timedelta(days=days),
+            Event.end > now,
+        )
+        .order_by(Event.start)
+        .limit(limit)
+    )
+    return [json.loads(row.data) for row in rows]
+
+
+# =========================
+# STREAK, ĐIỂM & TỈ LỆ HOÀN THÀNH
+# =========================
+# Các chỉ số được cộng dồn khi ghi (UserStats, DailyStat) để dashboard chỉ đọc vài dòng
+POINTS_PER_COMPLETION = 10
+
+
+def _insert_on_conflict(model):
+    """INSERT có ON CONFLICT (Postgres và SQLite đều hỗ trợ, cùng API)."""
+    if db.engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+
+def record_completion(user_id: int, day: date | None = None) -> bool:
+    """Ghi một lần hoàn thành buổi học và cập nhật các bảng tổng hợp.
+
+    Chỉ lần hoàn thành đầu tiên trong ngày được cộng điểm và tính streak; các lần sau vẫn được
+    đếm vào Completion/DailyStat nhưng không cộng điểm. Trả về True nếu lần này được cộng điểm.
+    """
+    day = day or date.today()
+    db.session.add(Completion(user_id=user_id, day=day))
+    # Upsert thay vì UPDATE rồi INSERT: hai lần hoàn thành đầu tiên cùng ngày chạy song song
+    # không còn đụng khoá chính (user_id, day)
+    insert = _insert_on_conflict(DailyStat).values(user_id=user_id, day=day, completed=1)
+    db.session.execute(insert.on_conflict_do_update(
+        index_elements=["user_id", "day"],
+        set_={"completed": DailyStat.completed + 1},
+    ))
+    # Tạo sẵn dòng UserStats (bỏ qua nếu đã có) để with_for_update luôn có dòng để khoá
+    db.session.execute(
+        _insert_on_conflict(UserStats)
+        .values(user_id=user_id, streak=0, best_streak=0, total_points=0, total_completions=0)
+        .on_conflict_do_nothing(index_elements=["user_id"])
+    )
+    stats = db.session.query(UserStats).filter_by(user_id=user_id).with_for_update().populate_existing().one()
+    first_today = stats.last_day is None or day > stats.last_day
+    if first_today:
+        stats.streak = stats.streak + 1 if stats.last_day == day - timedelta(days=1) else 1
+        stats.best_streak = max(stats.best_streak, stats.streak)
+        stats.last_day = day
+        stats.total_points += POINTS_PER_COMPLETION
+    stats.total_completions += 1
+    db.session.commit()
+    return first_today
+
+
+def dashboard_stats(user_id: int | None) -> dict:
+    """Streak, điểm, tỉ lệ hoàn thành và số buổi 7 ngày qua, đọc từ bảng tổng hợp."""
+    today = date.today()
+    week = [today - timedelta(days=i) for i in range(6, -1, -1)]
+    stats = db.session.get(UserStats, user_id) if user_id else None
+    if not stats:
+        return {"streak": 0, "total_points": 0, "completion_rate": 0, "counts": [0] * 7}
+    daily = dict(
+        db.session.query(DailyStat.day, DailyStat.completed)
+        .filter(DailyStat.user_id == user_id, DailyStat.day >= week[0], DailyStat.day <= today)
+    )
+    counts = [daily.get(d, 0) for d in week]
+    # Streak chỉ còn hiệu lực nếu hôm nay hoặc hôm qua có hoàn thành
+    streak = stats.streak if stats.last_day and stats.last_day >= today - timedelta(days=1) else 0
+    return {
+        "streak": streak,
+        "total_points": stats.total_points,
+        # Tỉ lệ số ngày có học trong 7 ngày gần nhất
+        "completion_rate": round(100 * sum(1 for c in counts if c) / 7),
+        "counts": counts,
+    }
 
 
 # =========================
@@ -140,30 +1393,29 @@ def clear_old_tokens():
 # =========================
 @app.route("/")
 def dashboard():
+    email = session.get("google_email")
+    user_id = user_id_for(email)
+    stats = dashboard_stats(user_id)
     user = {
-        "streak": 5,
-        "total_points": 120,
-        "email": session.get("google_email") or "student@example.com",
+        "streak": stats["streak"],
+        "total_points": stats["total_points"],
+        "email": email or "student@example.com",
     }
-    completion_rate = 85
+    completion_rate = stats["completion_rate"]
     days = [(date.today() - timedelta(days=i)).strftime("%d/%m") for i in range(6, -1, -1)]
-    counts = [2, 1, 3, 2, 0, 2, 3]
+    counts = stats["counts"]
 
     events = []
-    if session.get("google_email"):
-        service = get_google_calendar_service()
-        if service:
-            now = datetime.utcnow().isoformat() + "Z"
-            week_ahead = (datetime.utcnow() + timedelta(days=7)).isoformat() + "Z"
-            results = service.events().list(
-                calendarId="primary",
-                timeMin=now,
-                timeMax=week_ahead,
-                maxResults=50,
-                singleEvents=True,
-                orderBy="startTime",
-            ).execute()
-            events = results.get("items", [])
+    if user_id:
+        state = db.session.get(CalendarSync, user_id)
+        if state is None:
+            # Lần đầu: đồng bộ ở nền, trong lúc chờ lấy 7 ngày tới thẳng từ Google
+            request_event_sync(email, user_id)
+            events = live_upcoming_events(user_id)
+        else:
+            if time.time() - state.synced_at > EVENT_SYNC_TTL:
+                request_event_sync(email, user_id)
+            events = upcoming_events(user_id)
 
     return render_template(
         "dashboard.html",
@@ -185,7 +1437,6 @@ def authorize():
     if not GOOGLE_ENABLED:
         flash("⚠️ Thiếu credentials.json — không thể xác thực Google Calendar.", "error")
         return redirect(url_for("dashboard"))
-    clear_old_tokens()
     flow = build_flow(redirect_uri=_redirect_base())
     authorization_url, state = flow.authorization_url(
         access_type="offline", include_granted_scopes="true", prompt="consent",
@@ -202,17 +1453,15 @@ def oauth2callback():
     try:
         state = session.get("state")
         flow = build_flow(redirect_uri=_redirect_base(), state=state)
-        flow.fetch_token(authorization_response=request.url)
+        with trace_span("oauth.token"):
+            flow.fetch_token(authorization_response=request.url)
         creds = flow.credentials
-        oauth2 = build("oauth2", "v2", credentials=creds)
-        user_info = oauth2.userinfo().get().execute()
+        oauth2 = build_service("oauth2", "v2", creds)
+        with trace_span("oauth2.userinfo.get"):
+            user_info = oauth2.userinfo().get().execute()
         email = user_info.get("email")
         session["google_email"] = email
-        with open(get_token_filename(email), "wb") as f:
-            pickle.dump(creds, f)
-        if not User.query.filter_by(email=email).first():
-            db.session.add(User(email=email))
-            db.session.commit()
+        save_credentials(email, creds)
         flash(f"✅ Đăng nhập thành công với {email}!", "success")
     except Exception as e:
         flash(f"❌ Google authentication error: {str(e)}", "error")
@@ -238,6 +1487,9 @@ def add_event():
         end_time = request.form["end_time"]
         service = get_google_calendar_service()
         if not service:
+            if google_reconnecting():
+                flash("🔄 Đang kết nối lại Google Calendar, vui lòng thử lại sau vài giây.", "info")
+                return redirect(url_for("add_event"))
             flash("⚠️ Bạn cần kết nối Google Calendar trước.", "warning")
             return redirect(url_for("authorize"))
         try:
@@ -249,7 +1501,12 @@ def add_event():
                 "end": {"dateTime": end_dt.isoformat(), "timeZone": "Asia/Ho_Chi_Minh"},
                 "reminders": {"useDefault": False, "overrides": [{"method": "popup", "minutes": 15}]},
             }
-            service.events().insert(calendarId="primary", body=event).execute()
+            user_id = user_id_for(session.get("google_email"))
+            created = calendar_execute(
+                service.events().insert(calendarId="primary", body=event), user_id, retries=CALENDAR_REQUEST_RETRIES
+            )
+            if user_id:
+                upsert_events(user_id, [created])
             flash(f"✅ Đã tạo sự kiện: {title}", "success")
         except Exception as e:
             flash(f"❌ Lỗi khi tạo sự kiện: {str(e)}", "error")
@@ -262,6 +1519,374 @@ def add_event_form():
     return redirect(url_for("add_event"))
 
 
+IMPORT_REQUIRED_COLUMNS = ["ngày", "tháng", "năm", "giờ", "nội dung nhắc nhở", "thời gian nhắc nhở", "thời gian kết thúc"]
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "4"))
+# Số request Calendar tối đa trong một lượt của scheduler trước khi nhường cho user khác
+IMPORT_SLICE_REQUESTS = int(os.getenv("IMPORT_SLICE_REQUESTS", "100"))
+# Bật /debug/import_scheduler (số dòng/giây theo email user nên mặc định tắt)
+IMPORT_DEBUG = os.getenv("IMPORT_DEBUG", "0") == "1"
+# Job của worker ở máy khác coi như mất nếu không cập nhật tiến độ trong khoảng này (giây)
+IMPORT_STALE_AFTER = int(os.getenv("IMPORT_STALE_AFTER", "1800"))
+
+
+class ImportScheduler:
+    """Chạy các job import trên thread pool, xoay vòng giữa các user.
+
+    Mỗi job là một iterator các bước nhỏ; một user chỉ chạy một bước tại một
+    thời điểm rồi xếp lại cuối hàng, nên file 5.000 dòng của một người không
+    chặn file 20 dòng của người khác.
+    """
+
+    THROUGHPUT_WINDOW = 60
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.cond = threading.Condition()
+        self.jobs: dict[str, deque] = {}
+        self.ready: deque = deque()
+        self.running: set[str] = set()
+        self.history: dict[str, deque] = {}
+        self.started = False
+
+    def submit(self, user_key: str, steps: Iterator[int]):
+        with self.cond:
+            if not self.started:
+                for n in range(self.workers):
+                    threading.Thread(target=self._worker, name=f"import-{n}", daemon=True).start()
+                self.started = True
+            if user_key not in self.jobs:
+                IMPORT_ACTIVE_USERS.inc()
+            self.jobs.setdefault(user_key, deque()).append(steps)
+            IMPORT_QUEUED_JOBS.inc()
+            if user_key not in self.running and user_key not in self.ready:
+                self.ready.append(user_key)
+                self.cond.notify()
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.ready:
+                    self.cond.wait()
+                user_key = self.ready.popleft()
+                self.running.add(user_key)
+                steps = self.jobs[user_key][0]
+            finished, rows = False, 0
+            try:
+                with app.app_context():
+                    rows = next(steps)
+            except StopIteration:
+                finished = True
+            except Exception as e:
+                print(f"⚠️ Job import lỗi ({user_key}): {e}")
+                finished = True
+            if rows:
+                IMPORT_ROWS.inc(rows)
+            with self.cond:
+                self.running.discard(user_key)
+                now = time.monotonic()
+                if rows:
+                    self.history.setdefault(user_key, deque()).append((now, rows))
+                # Cắt lịch sử ngay khi ghi (user hết job thì bỏ hẳn) để bộ nhớ không phụ thuộc việc có ai gọi stats()
+                samples = self.history.get(user_key)
+                while samples and samples[0][0] < now - self.THROUGHPUT_WINDOW:
+                    samples.popleft()
+                if samples is not None and not samples:
+                    del self.history[user_key]
+                if finished:
+                    self.jobs[user_key].popleft()
+                    IMPORT_QUEUED_JOBS.dec()
+                if self.jobs[user_key]:
+                    self.ready.append(user_key)
+                    self.cond.notify()
+                else:
+                    del self.jobs[user_key]
+                    self.history.pop(user_key, None)
+                    IMPORT_ACTIVE_USERS.dec()
+
+    def stats(self) -> dict:
+        """Độ sâu hàng đợi và số dòng/giây của từng user trong THROUGHPUT_WINDOW giây gần nhất.
+
+        Chỉ là số liệu của worker hiện tại, xem qua /debug/import_scheduler khi IMPORT_DEBUG=1;
+        số liệu gộp mọi worker nằm ở /metrics.
+        """
+        cutoff = time.monotonic() - self.THROUGHPUT_WINDOW
+        with self.cond:
+            throughput = {}
+            for user_key, samples in list(self.history.items()):
+                while samples and samples[0][0] < cutoff:
+                    samples.popleft()
+                if samples:
+                    throughput[user_key] = round(sum(rows for _, rows in samples) / self.THROUGHPUT_WINDOW, 2)
+                else:
+                    del self.history[user_key]
+            return {
+                "queued_jobs": sum(len(q) for q in self.jobs.values()),
+                "active_users": len(self.jobs),
+                "running": len(self.running),
+                "rows_per_second": throughput,
+            }
+
+
+import_scheduler = ImportScheduler(IMPORT_WORKERS)
+
+
+# Số dòng mỗi chunk khi đọc file import theo luồng
+IMPORT_CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS", "5000"))
+
+
+def iter_timetable_chunks(path: str, filename: str) -> Iterator[pd.DataFrame]:
+    """Đọc file import theo từng chunk, không nạp cả file vào bộ nhớ."""
+    pd = _pandas()
+    if not filename.endswith(".xlsx"):
+        yield from pd.read_csv(path, chunksize=IMPORT_CHUNK_ROWS)
+        return
+    wb = _load_workbook()(path, read_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = ["" if c is None else str(c) for c in header]
+        batch = []
+        for row in rows:
+            batch.append(row[:len(columns)])
+            if len(batch) >= IMPORT_CHUNK_ROWS:
+                yield pd.DataFrame(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns)
+    finally:
+        wb.close()
+
+
+def _clock_offset(times: pd.Series) -> pd.Series:
+    """Đổi cột giờ dạng HH:MM hoặc HH:MM:SS thành khoảng thời gian tính từ 0h."""
+    pd = _pandas()
+    text = times.astype(str).str.strip()
+    clock = pd.to_datetime(text, format="%H:%M", errors="coerce")
+    missing = clock.isna()
+    if missing.any():
+        clock[missing] = pd.to_datetime(text[missing], format="%H:%M:%S", errors="coerce")
+    return clock - clock.dt.normalize()
+
+
+def parse_timetable(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.Series]:
+    """Parse toàn bộ thời khoá biểu một lần bằng pandas thay vì từng dòng.
+
+    Trả về (frame gồm summary/start/end/minutes, mask True ở các dòng lỗi).
+    """
+    pd, np = _pandas(), _numpy()
+    norm_cols = {str(c).strip().lower(): c for c in df.columns}
+    for col in IMPORT_REQUIRED_COLUMNS:
+        if col not in norm_cols:
+            raise ValueError(f"Thiếu cột bắt buộc: {col}")
+
+    def numeric(name: str) -> pd.Series:
+        return np.trunc(pd.to_numeric(df[norm_cols[name]], errors="coerce"))
+
+    dates = pd.to_datetime(
+        pd.DataFrame({"year": numeric("năm"), "month": numeric("tháng"), "day": numeric("ngày")}),
+        errors="coerce",
+    )
+    start = dates + _clock_offset(df[norm_cols["giờ"]])
+    end = dates + _clock_offset(df[norm_cols["thời gian kết thúc"]])
+    minutes = numeric("thời gian nhắc nhở")
+    errors = start.isna() | end.isna() | minutes.isna()
+    parsed = pd.DataFrame({
+        "summary": df[norm_cols["nội dung nhắc nhở"]].astype(str).str.strip(),
+        "start": start,
+        "end": end,
+        "minutes": minutes,
+    })[~errors]
+    return parsed, errors
+
+
+# Khoá trong extendedProperties.private để nhận ra dòng đã import
+IMPORT_KEY_PROP = "slcImportKey"
+IMPORT_HASH_PROP = "slcImportHash"
+
+
+def import_fingerprint(summary: str, start: str, end: str, minutes: int) -> dict:
+    """Khoá nhận dạng dòng (ngày, giờ, nội dung) và hash nội dung (thêm giờ kết thúc, nhắc nhở)."""
+    key = hashlib.sha256(f"{start}|{summary}".encode()).hexdigest()[:32]
+    content = hashlib.sha256(f"{start}|{end}|{summary}|{minutes}".encode()).hexdigest()[:32]
+    return {IMPORT_KEY_PROP: key, IMPORT_HASH_PROP: content}
+
+
+def timetable_events(df: pd.DataFrame) -> tuple[list[dict], int]:
+    """Chuyển DataFrame thời khoá biểu thành danh sách event, trả về (events, số dòng lỗi)."""
+    parsed, errors = parse_timetable(df)
+    tz = "Asia/Ho_Chi_Minh"
+    events = [
+        {
+            "summary": summary,
+            "start": {"dateTime": start, "timeZone": tz},
+            "end": {"dateTime": end, "timeZone": tz},
+            "reminders": {"useDefault": False, "overrides": [{"method": "popup", "minutes": minutes}]},
+            "extendedProperties": {"private": import_fingerprint(summary, start, end, minutes)},
+        }
+        for summary, start, end, minutes in zip(
+            parsed["summary"],
+            parsed["start"].dt.strftime("%Y-%m-%dT%H:%M:%S"),
+            parsed["end"].dt.strftime("%Y-%m-%dT%H:%M:%S"),
+            parsed["minutes"].astype(int).tolist(),
+        )
+    ]
+    return events, int(errors.sum())
+
+
+def plan_import(user_id: int | None, events: list[dict], seen: set[str]) -> tuple[list[dict], list[tuple[str, dict]], int]:
+    """Chia các event thành (cần thêm, cần sửa, số dòng bỏ qua) dựa trên bảng Event.
+
+    `seen` giữ các khoá đã gặp trong chunk để dòng trùng lặp chỉ được xử lý một lần; dòng trùng
+    với chunk trước đã có trong bảng Event (upsert sau mỗi lượt) nên được nhận ra qua truy vấn.
+    """
+    keys = [e["extendedProperties"]["private"][IMPORT_KEY_PROP] for e in events]
+    existing = {}
+    if user_id and keys:
+        existing = {
+            key: (google_id, content)
+            for key, google_id, content in
+            db.session.query(Event.import_key, Event.google_id, Event.import_hash)
+            .filter(Event.user_id == user_id, Event.import_key.in_(keys))
+        }
+    to_insert, to_update, skipped = [], [], 0
+    for key, event in zip(keys, events):
+        if key in seen:
+            skipped += 1
+            continue
+        seen.add(key)
+        match = existing.get(key)
+        if match is None:
+            to_insert.append(event)
+        elif match[1] == event["extendedProperties"]["private"][IMPORT_HASH_PROP]:
+            skipped += 1
+        else:
+            to_update.append((match[0], event))
+    return to_insert, to_update, skipped
+
+
+def import_job_steps(job_id: str, filename: str, path: str, service) -> Iterator[int]:
+    """Các bước của một job import; mỗi lần next() xử lý một phần nhỏ và trả về số dòng đã xử lý.
+
+    Scheduler mở app context riêng cho từng bước (có thể ở thread khác), nên
+    ImportJob được đọc lại từ DB mỗi lần ghi tiến độ.
+    """
+    counts = {"total": 0, "done": 0, "failed": 0, "skipped": 0}
+
+    def _save(**fields):
+        job = db.session.get(ImportJob, job_id)
+        for name, value in {**counts, **fields}.items():
+            setattr(job, name, value)
+        job.updated_at = datetime.utcnow()
+        db.session.commit()
+        return job
+
+    job = _save(status="running")
+    user_id = user_id_for(job.email)
+    try:
+        if user_id:
+            # Cập nhật bảng Event trước để nhận ra các dòng đã import lần trước
+            try:
+                sync_user_events(service, user_id)
+            except Exception:
+                db.session.rollback()
+        yield 0
+        for df in iter_timetable_chunks(path, filename):
+            events, parse_failures = timetable_events(df)
+            # seen chỉ sống trong một chunk để bộ nhớ không tăng theo kích thước file
+            to_insert, to_update, skipped = plan_import(user_id, events, set())
+            counts["total"] += len(df)
+            counts["failed"] += parse_failures
+            counts["skipped"] += skipped
+            counts["done"] += skipped
+            _save()
+            slices = [
+                (run, items[k:k + IMPORT_SLICE_REQUESTS])
+                for run, items in ((insert_events_batched, to_insert), (update_events_batched, to_update))
+                for k in range(0, len(items), IMPORT_SLICE_REQUESTS)
+            ]
+            for run, items in slices:
+                written = []
+                ok, fail = run(service, items, None, written, user_key=user_id)
+                counts["done"] += ok
+                counts["failed"] += fail
+                if user_id:
+                    upsert_events(user_id, written)
+                _save()
+                yield len(items)
+        _save(
+            status="done",
+            message=f"Import xong! Thành công: {counts['done']} (không đổi, bỏ qua: {counts['skipped']}), lỗi: {counts['failed']}.",
+        )
+    except Exception as e:
+        db.session.rollback()
+        _save(status="error", message=f"Không xử lý được file: {str(e)}")
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+# =========================
+# DỌN JOB IMPORT BỊ BỎ DỞ
+# =========================
+# Hàng đợi import chỉ nằm trong bộ nhớ worker: worker chết (deploy, timeout, max_requests) thì
+# job của nó không bao giờ chạy tiếp. Job như vậy được đánh dấu lỗi và file tạm bị xoá.
+_import_sweep_done = False
+
+
+def import_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def import_job_orphaned(job: ImportJob) -> bool:
+    """Job chưa xong mà worker giữ nó không còn sống."""
+    if job.status not in ("queued", "running"):
+        return False
+    host, _, pid = (job.worker or "").rpartition(":")
+    if host == socket.gethostname() and pid.isdigit():
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+    # Worker ở máy khác (hoặc job cũ không ghi worker): dựa vào lần cập nhật tiến độ cuối
+    return datetime.utcnow() - (job.updated_at or job.created_at) > timedelta(seconds=IMPORT_STALE_AFTER)
+
+
+def expire_import_job(job: ImportJob):
+    job.status = "error"
+    job.message = "Job import bị gián đoạn do máy chủ khởi động lại, vui lòng tải file lên lại."
+    job.updated_at = datetime.utcnow()
+    if job.path:
+        with contextlib.suppress(OSError):
+            os.remove(job.path)
+    db.session.commit()
+
+
+def sweep_orphaned_imports():
+    for job in ImportJob.query.filter(ImportJob.status.in_(("queued", "running"))):
+        if import_job_orphaned(job):
+            print(f"⚠️ Job import {job.id} bị bỏ dở (worker {job.worker}), đánh dấu lỗi")
+            expire_import_job(job)
+
+
+@app.before_request
+def _ensure_import_sweep():
+    # Mỗi worker dọn một lần khi nhận request đầu tiên
+    global _import_sweep_done
+    if _import_sweep_done:
+        return
+    _import_sweep_done = True
+    try:
+        sweep_orphaned_imports()
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ Không dọn được job import cũ: {e}")
+
+
 @app.route("/upload", methods=["GET", "POST"])
 def upload():
     if request.method == "POST":
@@ -269,63 +1894,244 @@ def upload():
         if not file or file.filename == "":
             flash("⚠️ Chưa chọn file.", "warning")
             return redirect(url_for("upload"))
-        try:
-            filename = file.filename.lower()
-            df = pd.read_excel(file) if filename.endswith(".xlsx") else pd.read_csv(file)
-        except Exception as e:
-            flash(f"❌ Không đọc được file: {str(e)}", "error")
-            return redirect(url_for("upload"))
-        service = get_google_calendar_service()
+        service = get_google_calendar_service(fresh=True)
         if not service:
+            if google_reconnecting():
+                flash("🔄 Đang kết nối lại Google Calendar, vui lòng thử lại sau vài giây.", "info")
+                return redirect(url_for("upload"))
             flash("⚠️ Hãy kết nối Google trước.", "warning")
             return redirect(url_for("authorize"))
-        norm_cols = {c.strip().lower(): c for c in df.columns}
-        required = ["ngày", "tháng", "năm", "giờ", "nội dung nhắc nhở", "thời gian nhắc nhở", "thời gian kết thúc"]
-        for col in required:
-            if col not in norm_cols:
-                flash(f"❌ Thiếu cột bắt buộc: {col}", "error")
-                return redirect(url_for("upload"))
-        successes, failures = 0, 0
-        tz = "Asia/Ho_Chi_Minh"
-        for _, row in df.iterrows():
-            try:
-                day = int(row[norm_cols["ngày"]])
-                month = int(row[norm_cols["tháng"]])
-                year = int(row[norm_cols["năm"]])
-                title = str(row[norm_cols["nội dung nhắc nhở"]]).strip()
-                start_dt = parser.parse(f"{year}-{month:02d}-{day:02d} {row[norm_cols['giờ']]}")
-                end_dt = parser.parse(f"{year}-{month:02d}-{day:02d} {row[norm_cols['thời gian kết thúc']]}")
-                minutes_before = int(row[norm_cols["thời gian nhắc nhở"]])
-                event = {
-                    "summary": title,
-                    "start": {"dateTime": start_dt.isoformat(), "timeZone": tz},
-                    "end": {"dateTime": end_dt.isoformat(), "timeZone": tz},
-                    "reminders": {"useDefault": False, "overrides": [{"method": "popup", "minutes": minutes_before}]},
-                }
-                service.events().insert(calendarId="primary", body=event).execute()
-                successes += 1
-            except Exception:
-                failures += 1
-        flash(f"✅ Import xong! Thành công: {successes}, lỗi: {failures}.", "success")
-        return redirect(url_for("dashboard"))
-    return render_template("upload.html", google_enabled=GOOGLE_ENABLED, authenticated=("google_email" in session))
+        # Lưu file ra đĩa để job đọc theo luồng thay vì giữ toàn bộ nội dung trong RAM
+        filename = file.filename.lower()
+        fd, path = tempfile.mkstemp(prefix="import_", suffix=os.path.splitext(filename)[1])
+        os.close(fd)
+        file.save(path)
+        job = ImportJob(id=uuid.uuid4().hex, email=session.get("google_email"), path=path, worker=import_worker_id())
+        db.session.add(job)
+        db.session.commit()
+        import_scheduler.submit(job.email or "", import_job_steps(job.id, filename, path, service))
+        return redirect(url_for("upload", job=job.id))
+    return render_template(
+        "upload.html",
+        google_enabled=GOOGLE_ENABLED,
+        authenticated=("google_email" in session),
+        job_id=request.args.get("job"),
+    )
+
+
+@app.route("/upload/status/<job_id>")
+def upload_status(job_id):
+    job = db.session.get(ImportJob, job_id)
+    if not job or job.email != session.get("google_email"):
+        return {"error": "not found"}, 404
+    if import_job_orphaned(job):
+        expire_import_job(job)
+    return {
+        "id": job.id,
+        "status": job.status,
+        "total": job.total,
+        "done": job.done,
+        "failed": job.failed,
+        "skipped": job.skipped,
+        "message": job.message,
+    }
+
+
+@app.route("/debug/import_scheduler")
+def import_scheduler_stats():
+    if not IMPORT_DEBUG:
+        return {"error": "not found"}, 404
+    # Mỗi worker gunicorn có scheduler riêng: pid cho biết số liệu này của worker nào
+    return {"pid": os.getpid(), **import_scheduler.stats()}
+
+
+IMPORT_TEMPLATE_SAMPLE = [[20, 10, 2025, "08:00", "Ôn tập Toán", 15, "09:00"]]
+# File mẫu chỉ đổi khi code đổi: dùng mtime của app.py làm Last-Modified chung cho mọi worker
+_TEMPLATE_LAST_MODIFIED = int(os.path.getmtime(__file__))
+
+
+@functools.lru_cache(maxsize=None)
+def import_template(fmt: str) -> tuple[bytes, str]:
+    """Sinh file mẫu một lần mỗi process, trả về (nội dung, etag)."""
+    pd = _pandas()
+    df = pd.DataFrame(IMPORT_TEMPLATE_SAMPLE, columns=IMPORT_REQUIRED_COLUMNS)
+    buf = io.BytesIO()
+    if fmt == "csv":
+        # BOM để Excel hiển thị đúng tiếng Việt; pandas tự bỏ BOM khi đọc lại
+        buf.write(df.to_csv(index=False).encode("utf-8-sig"))
+    else:
+        with pd.ExcelWriter(buf, engine="openpyxl") as writer:
+            df.to_excel(writer, index=False)
+    # ETag tính từ định nghĩa mẫu (không từ bytes xlsx vốn chứa thời điểm tạo) để các worker trùng nhau
+    etag = hashlib.sha256(json.dumps([fmt, IMPORT_REQUIRED_COLUMNS, IMPORT_TEMPLATE_SAMPLE]).encode()).hexdigest()[:32]
+    return buf.getvalue(), etag
 
 
 @app.route("/download-template")
 def download_template():
-    cols = ["ngày", "tháng", "năm", "giờ", "nội dung nhắc nhở", "thời gian nhắc nhở", "thời gian kết thúc"]
-    sample = [[20, 10, 2025, "08:00", "Ôn tập Toán", 15, "09:00"]]
-    df = pd.DataFrame(sample, columns=cols)
-    buf = io.BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False)
-    buf.seek(0)
-    return send_file(buf, as_attachment=True, download_name="mau_import_lich_hoc.xlsx")
+    fmt = "csv" if request.args.get("format") == "csv" else "xlsx"
+    data, etag = import_template(fmt)
+    return send_file(
+        io.BytesIO(data),
+        mimetype="text/csv" if fmt == "csv" else None,
+        as_attachment=True,
+        download_name=f"mau_import_lich_hoc.{fmt}",
+        etag=etag,
+        last_modified=_TEMPLATE_LAST_MODIFIED,
+        max_age=3600,
+        conditional=True,
+    )
 
 
 # =========================
 # AI QUIZ GENERATOR
 # =========================
+# Giới hạn số lời gọi LLM đồng thời; mỗi lời gọi có deadline riêng
+QUIZ_WORKERS = int(os.getenv("QUIZ_WORKERS", "8"))
+QUIZ_LLM_TIMEOUT = float(os.getenv("QUIZ_LLM_TIMEOUT", "20"))
+QUIZ_FEEDBACK_TIMEOUT = float(os.getenv("QUIZ_FEEDBACK_TIMEOUT", "5"))
+# Số việc được chờ trong hàng đợi của pool (ngoài các việc đang chạy); đầy thì dùng fallback ngay
+# Cột topic/topic_key là String(255)
+QUIZ_TOPIC_MAX_CHARS = 255
+QUIZ_QUEUE_LIMIT = int(os.getenv("QUIZ_QUEUE_LIMIT", str(QUIZ_WORKERS * 2)))
+_quiz_executor = ThreadPoolExecutor(max_workers=QUIZ_WORKERS, thread_name_prefix="quiz")
+_quiz_slots = threading.BoundedSemaphore(QUIZ_WORKERS + QUIZ_QUEUE_LIMIT)
+
+
+def submit_quiz_task(fn, *args):
+    """Đưa việc vào pool quiz (trong bản sao context để span là con của request hiện tại).
+
+    Trả về None khi hàng đợi đã đầy.
+    """
+    if not _quiz_slots.acquire(blocking=False):
+        return None
+    try:
+        future = _quiz_executor.submit(contextvars.copy_context().run, fn, *args)
+    except Exception:
+        _quiz_slots.release()
+        raise
+    # Chạy cả khi future bị cancel()
+    future.add_done_callback(lambda _: _quiz_slots.release())
+    return future
+
+
+def fake_quiz(topic: str) -> list[dict]:
+    return [{"question": f"[FAKE AI] Câu {i} về {topic}?", "options": [f"{opt}. Lựa chọn" for opt in "ABCD"], "correct_answer": "A"} for i in range(1, 11)]
+
+
+def fallback_quiz(topic: str) -> list[dict]:
+    return [{"question": f"[Fallback] Câu {i} về {topic}?", "options": [f"{opt}. Đáp án" for opt in "ABCD"], "correct_answer": "A"} for i in range(1, 11)]
+
+
+def llm_quiz(client, topic: str, timeout: float = QUIZ_LLM_TIMEOUT) -> list[dict]:
+    prompt = f"""
+    Tạo 10 câu hỏi trắc nghiệm tiếng Việt về chủ đề "{topic}".
+    Mỗi câu có 4 lựa chọn A-D, 1 đáp án đúng.
+    Trả JSON chuẩn:
+    [{{"question":"...","options":["A. ...","B. ...","C. ...","D. ..."],"correct_answer":"A"}}]
+    """
+    with trace_span("openai.chat.completions", model="gpt-4o-mini", purpose="quiz") as span:
+        resp = client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.5,
+            timeout=timeout,
+        )
+        if getattr(resp, "usage", None):
+            span.set("llm.total_tokens", resp.usage.total_tokens)
+    return json.loads(resp.choices[0].message.content)
+
+
+def _finish_quiz_attempt(attempt_id: str, quiz: list[dict], status: str) -> bool:
+    """Ghi quiz nếu bài vẫn đang chờ (bài quá hạn đã được gán fallback thì bỏ qua)."""
+    written = (
+        db.session.query(QuizAttempt)
+        .filter(QuizAttempt.id == attempt_id, QuizAttempt.status == "pending")
+        .update({QuizAttempt.quiz: json.dumps(quiz, ensure_ascii=False), QuizAttempt.status: status}, synchronize_session=False)
+    )
+    db.session.commit()
+    return bool(written)
+
+
+def run_quiz_attempt(attempt_id: str, topic: str):
+    with app.app_context():
+        # Việc chờ lâu trong hàng đợi có thể đã quá deadline (trang đã dùng fallback): không gọi LLM nữa
+        attempt = db.session.get(QuizAttempt, attempt_id)
+        remaining = QUIZ_LLM_TIMEOUT - (datetime.utcnow() - attempt.created_at).total_seconds() if attempt else 0
+        if not attempt or attempt.status != "pending" or remaining <= 0:
+            db.session.remove()
+            return
+        client = _openai_client_or_none()
+        try:
+            quiz, status = llm_quiz(client, topic, timeout=remaining), "done"
+        except Exception:
+            quiz, status = fallback_quiz(topic), "fallback"
+        _finish_quiz_attempt(attempt_id, quiz, status)
+        if status == "done":
+            try:
+                store_quiz_variant(normalize_topic(topic), quiz)
+            except Exception:
+                db.session.rollback()
+        db.session.remove()
+
+
+# Cache quiz theo chủ đề đã chuẩn hoá, nhiều biến thể mỗi chủ đề
+QUIZ_CACHE_VARIANTS = int(os.getenv("QUIZ_CACHE_VARIANTS", "3"))
+QUIZ_CACHE_MAX_ENTRIES = int(os.getenv("QUIZ_CACHE_MAX_ENTRIES", "2000"))
+QUIZ_CACHE_TTL = int(os.getenv("QUIZ_CACHE_TTL", str(30 * 24 * 3600)))
+# Bài làm (kể cả bài bỏ dở ở trạng thái pending) bị xoá sau QUIZ_ATTEMPT_TTL giây;
+# việc dọn chạy tối đa một lần mỗi QUIZ_ATTEMPT_PURGE_INTERVAL giây mỗi worker
+QUIZ_ATTEMPT_TTL = int(os.getenv("QUIZ_ATTEMPT_TTL", str(7 * 24 * 3600)))
+QUIZ_ATTEMPT_PURGE_INTERVAL = 600
+_quiz_attempts_purged_at = 0.0
+
+
+def normalize_topic(topic: str) -> str:
+    """Chuẩn hoá chủ đề: NFC (giữ dấu tiếng Việt), casefold, gộp khoảng trắng."""
+    # casefold có thể làm chuỗi dài ra (vd. "ß" -> "ss") nên cắt lại cho vừa cột topic_key
+    return " ".join(unicodedata.normalize("NFC", topic).casefold().split())[:QUIZ_TOPIC_MAX_CHARS]
+
+
+def cached_quiz(topic_key: str) -> list[dict] | None:
+    """Trả về một biến thể ngẫu nhiên khi chủ đề đã có đủ biến thể còn hạn."""
+    cutoff = datetime.utcnow() - timedelta(seconds=QUIZ_CACHE_TTL)
+    rows = QuizCache.query.filter(QuizCache.topic_key == topic_key, QuizCache.created_at > cutoff).all()
+    QUIZ_CACHE_REQUESTS.labels("hit" if len(rows) >= QUIZ_CACHE_VARIANTS else "miss").inc()
+    if len(rows) < QUIZ_CACHE_VARIANTS:
+        return None
+    row = random.choice(rows)
+    row.last_used_at = datetime.utcnow()
+    db.session.commit()
+    return json.loads(row.quiz)
+
+
+def store_quiz_variant(topic_key: str, quiz: list[dict]):
+    db.session.add(QuizCache(topic_key=topic_key, quiz=json.dumps(quiz, ensure_ascii=False)))
+    db.session.commit()
+    # Dọn mục quá hạn rồi giới hạn kích thước theo LRU (last_used_at)
+    cutoff = datetime.utcnow() - timedelta(seconds=QUIZ_CACHE_TTL)
+    QuizCache.query.filter(QuizCache.created_at <= cutoff).delete(synchronize_session=False)
+    overflow = QuizCache.query.count() - QUIZ_CACHE_MAX_ENTRIES
+    if overflow > 0:
+        stale_ids = [
+            row_id for (row_id,) in
+            db.session.query(QuizCache.id).order_by(QuizCache.last_used_at).limit(overflow)
+        ]
+        QuizCache.query.filter(QuizCache.id.in_(stale_ids)).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def purge_quiz_attempts():
+    global _quiz_attempts_purged_at
+    now = time.monotonic()
+    if now - _quiz_attempts_purged_at < QUIZ_ATTEMPT_PURGE_INTERVAL:
+        return
+    _quiz_attempts_purged_at = now
+    cutoff = datetime.utcnow() - timedelta(seconds=QUIZ_ATTEMPT_TTL)
+    QuizAttempt.query.filter(QuizAttempt.created_at <= cutoff).delete(synchronize_session=False)
+    db.session.commit()
+
+
 @app.route("/generate_quiz", methods=["GET", "POST"])
 def generate_quiz():
     if request.method == "POST":
@@ -333,37 +2139,89 @@ def generate_quiz():
         if not topic:
             flash("⚠️ Vui lòng nhập chủ đề/bài học.", "warning")
             return redirect(url_for("generate_quiz"))
+        if len(topic) > QUIZ_TOPIC_MAX_CHARS:
+            flash(f"⚠️ Chủ đề quá dài (tối đa {QUIZ_TOPIC_MAX_CHARS} ký tự).", "warning")
+            return redirect(url_for("generate_quiz"))
+        attempt = QuizAttempt(id=uuid.uuid4().hex, topic=topic, email=session.get("google_email"))
         client = _openai_client_or_none()
-        if not client:
-            quiz = [{"question": f"[FAKE AI] Câu {i} về {topic}?", "options": [f"{opt}. Lựa chọn" for opt in "ABCD"], "correct_answer": "A"} for i in range(1, 11)]
-        else:
-            prompt = f"""
-            Tạo 10 câu hỏi trắc nghiệm tiếng Việt về chủ đề "{topic}".
-            Mỗi câu có 4 lựa chọn A-D, 1 đáp án đúng.
-            Trả JSON chuẩn:
-            [{{"question":"...","options":["A. ...","B. ...","C. ...","D. ..."],"correct_answer":"A"}}]
-            """
-            try:
-                resp = client.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": prompt}], temperature=0.5)
-                quiz = json.loads(resp.choices[0].message.content)
-            except Exception:
-                quiz = [{"question": f"[Fallback] Câu {i} về {topic}?", "options": [f"{opt}. Đáp án" for opt in "ABCD"], "correct_answer": "A"} for i in range(1, 11)]
-        session["quiz"], session["topic"] = quiz, topic
-        return render_template("quiz.html", quiz=quiz, topic=topic)
+        quiz = cached_quiz(normalize_topic(topic)) if client else fake_quiz(topic)
+        if quiz is not None:
+            attempt.quiz, attempt.status = json.dumps(quiz, ensure_ascii=False), "done"
+        db.session.add(attempt)
+        db.session.commit()
+        if quiz is None and submit_quiz_task(run_quiz_attempt, attempt.id, topic) is None:
+            _finish_quiz_attempt(attempt.id, fallback_quiz(topic), "fallback")
+        purge_quiz_attempts()
+        return redirect(url_for("quiz_page", attempt_id=attempt.id))
     return render_template("generate_quiz.html")
 
 
+def _quiz_attempt_or_deadline(attempt_id: str) -> QuizAttempt | None:
+    """Lấy bài làm; nếu quá deadline mà LLM chưa trả lời thì dùng quiz fallback."""
+    attempt = db.session.get(QuizAttempt, attempt_id)
+    if attempt and attempt.status == "pending" and datetime.utcnow() - attempt.created_at > timedelta(seconds=QUIZ_LLM_TIMEOUT):
+        _finish_quiz_attempt(attempt.id, fallback_quiz(attempt.topic), "fallback")
+        db.session.refresh(attempt)
+    return attempt
+
+
+@app.route("/generate_quiz/status/<attempt_id>")
+def quiz_status(attempt_id):
+    attempt = _quiz_attempt_or_deadline(attempt_id)
+    if not attempt:
+        return {"error": "not found"}, 404
+    return {"id": attempt.id, "status": attempt.status, "url": url_for("quiz_page", attempt_id=attempt.id)}
+
+
+@app.route("/quiz/<attempt_id>")
+def quiz_page(attempt_id):
+    attempt = _quiz_attempt_or_deadline(attempt_id)
+    if not attempt:
+        flash("⚠️ Không tìm thấy bài trắc nghiệm.", "warning")
+        return redirect(url_for("generate_quiz"))
+    if attempt.status == "pending":
+        return render_template("quiz.html", quiz=None, topic=attempt.topic, attempt_id=attempt.id)
+    # Cookie chỉ giữ id bài làm, nội dung quiz nằm ở bảng QuizAttempt
+    session["quiz_attempt"] = attempt.id
+    return render_template("quiz.html", quiz=json.loads(attempt.quiz), topic=attempt.topic)
+
+
+def llm_feedback(client, score: int, topic: str) -> str:
+    prompt = f"Đánh giá khi học sinh đạt {score}/10 điểm chủ đề '{topic}', bằng tiếng Việt, ngắn, có khích lệ."
+    with trace_span("openai.chat.completions", model="gpt-4o-mini", purpose="feedback") as span:
+        resp = client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.4,
+            timeout=QUIZ_FEEDBACK_TIMEOUT,
+        )
+        if getattr(resp, "usage", None):
+            span.set("llm.total_tokens", resp.usage.total_tokens)
+    return resp.choices[0].message.content
+
+
 @app.route("/submit_quiz", methods=["POST"])
 def submit_quiz():
-    quiz, topic = session.get("quiz", []), session.get("topic", "Bài học")
+    attempt_id = session.get("quiz_attempt")
+    attempt = db.session.get(QuizAttempt, attempt_id) if attempt_id else None
+    if not attempt or not attempt.quiz:
+        flash("⚠️ Không tìm thấy bài trắc nghiệm, hãy tạo bài mới.", "warning")
+        return redirect(url_for("generate_quiz"))
+    quiz, topic = json.loads(attempt.quiz), attempt.topic or "Bài học"
     score = sum(1 for i, q in enumerate(quiz, 1) if request.form.get(f"q{i}", "").startswith(q["correct_answer"]))
+    attempt.score, attempt.submitted_at = score, datetime.utcnow()
+    db.session.commit()
     client = _openai_client_or_none()
     if client:
-        try:
-            prompt = f"Đánh giá khi học sinh đạt {score}/10 điểm chủ đề '{topic}', bằng tiếng Việt, ngắn, có khích lệ."
-            resp = client.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": prompt}], temperature=0.4)
-            feedback = resp.choices[0].message.content
-        except Exception:
+        feedback = None
+        future = submit_quiz_task(llm_feedback, client, score, topic)
+        if future is not None:
+            try:
+                feedback = future.result(timeout=QUIZ_FEEDBACK_TIMEOUT)
+            except Exception:
+                # Việc còn nằm trong hàng đợi thì bỏ luôn, không gọi LLM cho trang đã trả về
+                future.cancel()
+        if feedback is None:
             feedback = f"Bạn đạt {score}/10. Hãy xem lại những câu sai và ôn lại nhé."
     else:
         feedback = f"[Fallback] Bạn đạt {score}/10. Tiếp tục cố gắng nhé!"
@@ -373,15 +2231,148 @@ def submit_quiz():
 # =========================
 # TIỆN ÍCH KHÁC
 # =========================
-@app.route("/mark_complete")
+@app.route("/mark_complete", methods=["POST"])
 def mark_complete():
-    flash("🎯 Bạn đã đánh dấu hoàn thành buổi học hôm nay!", "success")
+    # Chỉ nhận POST: link GET bị trình duyệt prefetch/crawler gọi lại sẽ ghi thêm dữ liệu
+    user_id = user_id_for(session.get("google_email"))
+    if not user_id:
+        flash("⚠️ Hãy đăng nhập Google để lưu tiến độ học tập.", "warning")
+        return redirect(url_for("dashboard"))
+    if record_completion(user_id):
+        flash("🎯 Bạn đã đánh dấu hoàn thành buổi học hôm nay!", "success")
+    else:
+        flash("✅ Đã ghi thêm một buổi học hôm nay (điểm chỉ cộng cho lần đầu mỗi ngày).", "info")
     return redirect(url_for("dashboard"))
 
 
+# =========================
+# METRICS (PROMETHEUS)
+# =========================
+# Dưới gunicorn nhiều worker, đặt PROMETHEUS_MULTIPROC_DIR (gunicorn.conf.py tự đặt) để mọi
+# worker ghi số liệu vào file mmap chung và /metrics gộp lại; không đặt thì chỉ là số liệu của process hiện tại.
+METRICS_MULTIPROC = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+REQUEST_COUNT = Counter(
+    "http_requests_total", "Số request theo route, method và mã trạng thái",
+    ["endpoint", "method", "status"],
+)
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Thời gian xử lý request theo route",
+    ["endpoint", "method"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Số request đang xử lý theo route",
+    ["endpoint"], multiprocess_mode="livesum",
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Kích thước body response theo route",
+    ["endpoint"],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+)
+
+
+DB_POOL_WAIT = Histogram(
+    "db_pool_wait_seconds", "Thời gian chờ lấy kết nối DB từ pool (gồm cả mở kết nối mới)",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5, 10),
+)
+DB_POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "Số lần hết thời gian chờ kết nối DB")
+DB_CONNECTIONS_OPENED = Counter("db_connections_opened_total", "Số kết nối DB mới được mở")
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out", "Số kết nối DB đang được dùng", multiprocess_mode="livesum",
+)
+
+# Bộ đếm của các thread nền, gộp qua mọi worker như số liệu request
+TOKEN_REFRESHES = Counter(
+    "token_refresh_total", "Số lượt làm mới token nền theo kết quả",
+    ["outcome"],
+)
+# Số user đang có job import và số job đang chờ/chạy; thông lượng trung bình mỗi user là
+# rate(import_rows_total) / import_active_users (không gắn nhãn theo user để số nhãn hữu hạn)
+IMPORT_QUEUED_JOBS = Gauge("import_queued_jobs", "Số job import đang chờ hoặc đang chạy", multiprocess_mode="livesum")
+IMPORT_ACTIVE_USERS = Gauge("import_active_users", "Số user đang có job import", multiprocess_mode="livesum")
+IMPORT_ROWS = Counter("import_rows_total", "Số dòng import đã gửi lên Google Calendar")
+QUIZ_CACHE_REQUESTS = Counter(
+    "quiz_cache_requests_total", "Số lần tra cache quiz theo kết quả (hit/miss)",
+    ["result"],
+)
+
+# Child metric đã gắn nhãn theo (route, method), tránh gọi .labels() nhiều lần mỗi request
+_route_metrics: dict[tuple[str, str], tuple] = {}
+# Method do client gửi tuỳ ý: ngoài các method chuẩn thì gộp vào "other" để số nhãn hữu hạn
+HTTP_METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "CONNECT", "TRACE"))
+
+
+def _metric_method(method: str) -> str:
+    return method if method in HTTP_METHODS else "other"
+
+
+def _route_children(endpoint: str, method: str) -> tuple:
+    children = _route_metrics.get((endpoint, method))
+    if children is None:
+        children = (
+            REQUEST_LATENCY.labels(endpoint, method),
+            REQUESTS_IN_FLIGHT.labels(endpoint),
+            RESPONSE_SIZE.labels(endpoint),
+        )
+        _route_metrics[(endpoint, method)] = children
+    return children
+
+
+def _metrics_start():
+    # Dùng tên route (không dùng URL) để số nhãn luôn hữu hạn
+    endpoint = request.endpoint or "not_found"
+    method = _metric_method(request.method)
+    children = _route_children(endpoint, method)
+    children[1].inc()
+    g.metrics = [time.perf_counter(), endpoint, children, False, method]
+
+
+# Đăng ký trước mọi before_request khác (warm pool, trace, last_seen, sweep import) để latency
+# tính cả thời gian của chúng, và request bị hook khác trả lời sớm vẫn được đếm
+app.before_request_funcs.setdefault(None, []).insert(0, _metrics_start)
+
+
+def _observe_request(status: int, size: int):
+    start, endpoint, (latency, _, response_size), _, method = g.metrics
+    latency.observe(time.perf_counter() - start)
+    response_size.observe(size)
+    REQUEST_COUNT.labels(endpoint, method, str(status)).inc()
+    g.metrics[3] = True
+
+
+@app.after_request
+def _metrics_record(response):
+    if "metrics" in g:
+        _observe_request(response.status_code, response.content_length or 0)
+    return response
+
+
+@app.teardown_request
+def _metrics_finish(exc):
+    if "metrics" not in g:
+        return
+    g.metrics[2][1].dec()
+    if not g.metrics[3]:
+        # Lỗi không bắt được: after_request không chạy, ghi nhận như 500
+        _observe_request(500, 0)
+
+
+@app.route("/metrics")
+def metrics():
+    registry = REGISTRY
+    if METRICS_MULTIPROC:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), 200, {"Content-Type": CONTENT_TYPE_LATEST}
+
+
 @app.route("/healthz")
 def healthz():
-    return {"status": "ok", "time": datetime.utcnow().isoformat()}
+    return {
+        "status": "ok",
+        "time": datetime.utcnow().isoformat(),
+        "db_pool": db.engine.pool.status(),
+    }
 
 @app.route("/upload_form")
 def upload_form():
@@ -389,9 +2380,105 @@ def upload_form():
 
 
 # =========================
-# KHỞI TẠO
+# KHỞI TẠO ỨNG DỤNG (APP FACTORY)
 # =========================
+_app_ready = False
+_app_ready_lock = threading.Lock()
+
+
+def init_db(flask_app: Flask):
+    url = database_url()
+    flask_app.config["SQLALCHEMY_DATABASE_URI"] = url
+    flask_app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    tuned = SQLITE_TUNED and is_sqlite_file(url)
+    postgres = PG_TUNED and url.startswith("postgresql")
+    if tuned:
+        flask_app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", sqlite_engine_options())
+    elif postgres:
+        flask_app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", postgres_engine_options())
+    db.init_app(flask_app)
+    with flask_app.app_context():
+        if tuned:
+            sa_event.listen(db.engine, "connect", _sqlite_on_connect)
+        sa_event.listen(db.engine, "connect", _pool_connect)
+        sa_event.listen(db.engine, "checkout", _pool_checkout)
+        sa_event.listen(db.engine, "checkin", _pool_checkin)
+
+
+def describe_db(flask_app: Flask) -> str:
+    url = flask_app.config["SQLALCHEMY_DATABASE_URI"]
+    if SQLITE_TUNED and is_sqlite_file(url):
+        return f"{url} (SQLite WAL)"
+    with flask_app.app_context():
+        return f"{url} ({db.engine.pool.status()})"
+
+
+def init_oauth(flask_app: Flask):
+    global GOOGLE_ENABLED
+    GOOGLE_ENABLED = oauth_client_config() is not None
+
+
+def warm_static_caches():
+    """Nạp trước thư viện nặng và dữ liệu chỉ đọc (discovery, file mẫu import)."""
+    for load in (_pandas, _numpy, _load_workbook, _build_from_document, _flow_class, _openai_class):
+        load()
+    discovery_doc("calendar", "v3")
+    for fmt in ("xlsx", "csv"):
+        import_template(fmt)
+
+
+def _after_fork_in_child():
+    """Worker vừa fork không dùng lại socket/kết nối DB kế thừa từ master."""
+    with _service_cache_lock:
+        _service_cache.clear()
+    # Thread xuất span không sống qua fork
+    span_exporter.started = False
+    span_exporter.spans = []
+    global _pool_warmed
+    _pool_warmed = False
+    if _app_ready:
+        with app.app_context():
+            db.engine.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def create_app(preload: bool | None = None, announce: bool = True) -> Flask:
+    """Khởi tạo app (gọi nhiều lần cũng chỉ init một lần).
+
+    `preload=True` (hoặc APP_PRELOAD=1) nạp sẵn thư viện nặng và cache tĩnh rồi
+    gc.freeze(), để master gunicorn chạy `--preload` làm một lần và các worker
+    fork ra dùng chung bộ nhớ copy-on-write:
+        APP_PRELOAD=1 gunicorn --preload app:app
+    `announce` in cấu hình DB đang dùng.
+    """
+    global _app_ready
+    if preload is None:
+        preload = os.getenv("APP_PRELOAD", "0") == "1"
+    with _app_ready_lock:
+        if not _app_ready:
+            init_db(app)
+            init_oauth(app)
+            _app_ready = True
+    if preload:
+        warm_static_caches()
+        # Đưa object hiện có ra khỏi GC để lần thu gom sau không ghi vào các trang nhớ dùng chung
+        gc.collect()
+        gc.freeze()
+    if announce:
+        print("✅ DATABASE_URL in use:", describe_db(app))
+    return app
+
+
+# `gunicorn app:app` và các script import `app` vẫn dùng được như trước nên app vẫn được init
+# lúc import (chỉ đọc cấu hình, chưa mở kết nối), nhưng không in gì; lời gọi create_app() tường minh mới in
+create_app(announce=False)
+
+
 if __name__ == "__main__":
+    create_app()
     with app.app_context():
         db.create_all()
     port = int(os.environ.get("PORT", 5000))
@@ -0,0 +1,36 @@
+"""Đo chi phí tạo service Calendar: build() gốc, doc đã cache, service đã cache.
+
+Chạy: python bench/bench_calendar_service.py [số_lần]
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app import _cached_service, build_service  # noqa: E402
+
+
+def timed(label: str, n: int, fn):
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    per_call = (time.perf_counter() - t0) / n
+    print(f"{label:>28}: {per_call * 1e6:10.1f} µs/lần")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    creds = Credentials(token="fake-token", expiry=datetime.utcnow() + timedelta(hours=1))
+    timed("build() mỗi request", n, lambda: build("calendar", "v3", credentials=creds, static_discovery=True))
+    timed("discovery doc đã cache", n, lambda: build_service("calendar", "v3", creds))
+    timed("service đã cache (LRU)", n, lambda: _cached_service("student@example.com", creds))
+
+
+if __name__ == "__main__":
+    main()
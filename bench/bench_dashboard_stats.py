@@ -0,0 +1,48 @@
+"""Đo chi phí đọc chỉ số dashboard theo độ dài lịch sử hoàn thành của user.
+
+Dùng SQLite tạm; với bảng tổng hợp, thời gian đọc không tăng theo lịch sử.
+
+Chạy: python bench/bench_dashboard_stats.py [số_lần_đọc]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+_tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'bench.db')}"
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app import User, app, dashboard_stats, db, record_completion  # noqa: E402
+
+
+def seed(email: str, days: int, per_day: int = 3) -> int:
+    user = User(email=email)
+    db.session.add(user)
+    db.session.commit()
+    start = date.today() - timedelta(days=days - 1)
+    for i in range(days):
+        for _ in range(per_day):
+            record_completion(user.id, start + timedelta(days=i))
+    return user.id
+
+
+def main():
+    reads = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with app.app_context():
+        db.create_all()
+        for label, days in (("1 tuần", 7), ("1 năm", 365)):
+            user_id = seed(f"{days}@example.com", days)
+            dashboard_stats(user_id)
+            t0 = time.perf_counter()
+            for _ in range(reads):
+                stats = dashboard_stats(user_id)
+                db.session.remove()
+            per_call = (time.perf_counter() - t0) / reads
+            print(f"{label:>7} lịch sử: {per_call * 1e6:8.1f} µs/lần (streak {stats['streak']}, "
+                  f"điểm {stats['total_points']})")
+
+
+if __name__ == "__main__":
+    main()
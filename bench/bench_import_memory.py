@@ -0,0 +1,59 @@
+"""So sánh RSS đỉnh khi import file lớn: đọc cả file vs đọc theo chunk.
+
+Mỗi chế độ chạy trong một process riêng để đo ru_maxrss độc lập.
+Bước insert lên Google được bỏ qua, chỉ đo đọc + parse + dựng event.
+
+Chạy: python bench/bench_import_memory.py [số_dòng]
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+
+def write_csv(path: str, rows: int):
+    header = "ngày,tháng,năm,giờ,nội dung nhắc nhở,thời gian nhắc nhở,thời gian kết thúc\n"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(header)
+        for i in range(rows):
+            f.write(f"{1 + i % 28},{1 + i % 12},2025,{6 + i % 12:02d}:00,Ôn tập bài {i},15,{7 + i % 12:02d}:30\n")
+
+
+def run_mode(mode: str, path: str):
+    from app import iter_timetable_chunks, timetable_events
+    import pandas as pd
+
+    t0 = time.perf_counter()
+    total = 0
+    if mode == "full":
+        events, _ = timetable_events(pd.read_csv(path))
+        total = len(events)
+    else:
+        for df in iter_timetable_chunks(path, path):
+            events, _ = timetable_events(df)
+            total += len(events)
+    elapsed = time.perf_counter() - t0
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{mode:>6}: {total} event, {elapsed:.1f}s, RSS đỉnh {peak_mb:.0f} MB")
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] in ("full", "stream"):
+        run_mode(sys.argv[1], sys.argv[2])
+        return
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "timetable.csv")
+        write_csv(path, rows)
+        print(f"File {rows} dòng: {os.path.getsize(path) / 1e6:.0f} MB")
+        for mode in ("full", "stream"):
+            subprocess.run([sys.executable, __file__, mode, path], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""So sánh parse từng dòng (iterrows + dateutil) với parse vector hoá.
+
+Chạy: python bench/bench_parse_timetable.py [số_dòng]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from dateutil import parser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app import IMPORT_REQUIRED_COLUMNS, parse_timetable  # noqa: E402
+
+
+def make_frame(n: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    hours = rng.integers(6, 20, n)
+    df = pd.DataFrame({
+        "ngày": rng.integers(1, 29, n),
+        "tháng": rng.integers(1, 13, n),
+        "năm": 2025,
+        "giờ": [f"{h:02d}:00" for h in hours],
+        "nội dung nhắc nhở": [f"Ôn tập {i}" for i in range(n)],
+        "thời gian nhắc nhở": 15,
+        "thời gian kết thúc": [f"{h + 1:02d}:30" for h in hours],
+    }, columns=IMPORT_REQUIRED_COLUMNS)
+    # 1% dòng lỗi
+    df["ngày"] = df["ngày"].astype(object)
+    df.loc[df.index[::100], "ngày"] = "abc"
+    return df
+
+
+def parse_rowwise(df: pd.DataFrame) -> int:
+    failures = 0
+    for _, row in df.iterrows():
+        try:
+            day, month, year = int(row["ngày"]), int(row["tháng"]), int(row["năm"])
+            parser.parse(f"{year}-{month:02d}-{day:02d} {row['giờ']}")
+            parser.parse(f"{year}-{month:02d}-{day:02d} {row['thời gian kết thúc']}")
+            int(row["thời gian nhắc nhở"])
+        except Exception:
+            failures += 1
+    return failures
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    df = make_frame(rows)
+
+    t0 = time.perf_counter()
+    _, errors = parse_timetable(df)
+    vectorized = time.perf_counter() - t0
+    print(f"vector hoá: {rows} dòng, {vectorized * 1000:.1f} ms, lỗi {int(errors.sum())}")
+
+    t0 = time.perf_counter()
+    failures = parse_rowwise(df)
+    rowwise = time.perf_counter() - t0
+    print(f" từng dòng: {rows} dòng, {rowwise * 1000:.1f} ms, lỗi {failures}")
+
+
+if __name__ == "__main__":
+    main()
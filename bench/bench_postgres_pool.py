@@ -0,0 +1,125 @@
+"""So sánh pool Postgres mặc định với profile PG_TUNED (pool chia theo worker, pre-ping, prepare).
+
+Mỗi process mô phỏng một worker gunicorn: nhiều thread liên tục chạy các truy vấn nóng
+(tra user theo email, dashboard_stats, upcoming_events) trong `thời_gian` giây.
+In số truy vấn/giây, p50/p99 thời gian mỗi vòng và số kết nối đã mở của từng profile.
+
+Cần DATABASE_URL trỏ vào một database Postgres trống, ví dụ:
+    DATABASE_URL=postgresql://postgres@/bench?host=/tmp/pgdata python bench/bench_postgres_pool.py
+
+Chạy: python bench/bench_postgres_pool.py [số_process] [số_thread] [thời_gian]
+"""
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SEED_USERS = 50
+
+
+def seed():
+    from app import User, app, db, record_completion
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add_all(User(email=f"seed{i}@example.com") for i in range(SEED_USERS))
+        db.session.commit()
+        for uid in range(1, SEED_USERS + 1):
+            record_completion(uid)
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def run_reader(threads: int, duration: float):
+    from app import DB_CONNECTIONS_OPENED, app, dashboard_stats, db, upcoming_events, user_id_for
+
+    samples: list[float] = []
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def loop():
+        nonlocal errors
+        while time.monotonic() < deadline:
+            # Mỗi vòng là một request: mượn kết nối, chạy truy vấn nóng rồi trả lại pool
+            t0 = time.perf_counter()
+            try:
+                with app.app_context():
+                    email = f"seed{random.randrange(SEED_USERS)}@example.com"
+                    uid = user_id_for(email)
+                    dashboard_stats(uid)
+                    upcoming_events(uid)
+                    db.session.remove()
+                with lock:
+                    samples.append(time.perf_counter() - t0)
+            except Exception:
+                with lock:
+                    errors += 1
+
+    workers = [threading.Thread(target=loop) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    opened = int(DB_CONNECTIONS_OPENED._value.get())
+    print(f"RESULT {len(samples)} {errors} {opened} " + ",".join(f"{s:.6f}" for s in samples))
+
+
+def run_profile(tuned: bool, processes: int, threads: int, duration: float):
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        PG_TUNED="1" if tuned else "0",
+        WEB_CONCURRENCY=str(processes),
+        WEB_THREADS=str(threads),
+    )
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    subprocess.run([sys.executable, __file__, "seed"], env=env, check=True, stdout=subprocess.DEVNULL)
+    procs = [
+        subprocess.Popen([sys.executable, __file__, "read", str(threads), str(duration)],
+                         env=env, stdout=subprocess.PIPE, text=True)
+        for _ in range(processes)
+    ]
+    samples: list[float] = []
+    errors = opened = 0
+    for proc in procs:
+        out, _ = proc.communicate()
+        line = next(line for line in out.splitlines() if line.startswith("RESULT"))
+        _, _count, err, conns, *rest = line.split(" ")
+        errors += int(err)
+        opened += int(conns)
+        if rest and rest[0]:
+            samples.extend(float(s) for s in rest[0].split(","))
+    return samples, errors, opened
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "seed":
+        seed()
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "read":
+        run_reader(int(sys.argv[2]), float(sys.argv[3]))
+        return
+    if not os.getenv("DATABASE_URL", "").startswith("postgres"):
+        raise SystemExit("Cần DATABASE_URL trỏ vào Postgres")
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+    print(f"{processes} process x {threads} thread, {duration:.0f}s mỗi profile")
+    for name, tuned in (("mặc định", False), ("tuned", True)):
+        samples, errors, opened = run_profile(tuned, processes, threads, duration)
+        print(f"{name:>9}: {len(samples) / duration:8.1f} vòng/s, p50 {percentile(samples, 50) * 1000:6.2f} ms, "
+              f"p99 {percentile(samples, 99) * 1000:6.2f} ms, {opened} kết nối đã mở, {errors} lỗi")
+
+
+if __name__ == "__main__":
+    main()
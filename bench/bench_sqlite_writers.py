@@ -0,0 +1,111 @@
+"""So sánh SQLite mặc định với profile tuned (WAL, synchronous=NORMAL, mmap, busy timeout).
+
+Mô phỏng nhiều worker gunicorn cùng ghi: mỗi process có vài thread, liên tục thêm
+User mới (đọc trước rồi ghi như lúc đăng nhập) và ghi hoàn thành buổi học
+(record_completion) trong `thời_gian` giây.
+In số commit/giây và số lần "database is locked" của từng profile.
+
+Chạy: python bench/bench_sqlite_writers.py [số_process] [số_thread] [thời_gian]
+"""
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SEED_USERS = 50
+
+
+def seed(db_path: str):
+    from app import User, app, db
+
+    with app.app_context():
+        db.create_all()
+        db.session.add_all(User(email=f"seed{i}@example.com") for i in range(SEED_USERS))
+        db.session.commit()
+
+
+def run_writer(threads: int, duration: float):
+    from app import User, app, db, record_completion
+
+    commits, locked, other = 0, 0, 0
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def loop():
+        nonlocal commits, locked, other
+        with app.app_context():
+            while time.monotonic() < deadline:
+                try:
+                    if random.random() < 0.5:
+                        # Giống save_credentials khi đăng nhập: đọc trước rồi mới thêm User
+                        email = f"{uuid.uuid4().hex}@example.com"
+                        if not User.query.filter_by(email=email).first():
+                            db.session.add(User(email=email))
+                        db.session.commit()
+                    else:
+                        record_completion(random.randint(1, SEED_USERS))
+                    with lock:
+                        commits += 1
+                except Exception as e:
+                    db.session.rollback()
+                    with lock:
+                        if "locked" in str(e):
+                            locked += 1
+                        else:
+                            other += 1
+            db.session.remove()
+
+    workers = [threading.Thread(target=loop) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    print(f"RESULT {commits} {locked} {other}")
+
+
+def run_profile(tuned: bool, processes: int, threads: int, duration: float) -> tuple[int, int, int]:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            PYTHONPATH=ROOT,
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            SQLITE_TUNED="1" if tuned else "0",
+        )
+        subprocess.run([sys.executable, __file__, "seed"], env=env, check=True, stdout=subprocess.DEVNULL)
+        procs = [
+            subprocess.Popen([sys.executable, __file__, "write", str(threads), str(duration)],
+                             env=env, stdout=subprocess.PIPE, text=True)
+            for _ in range(processes)
+        ]
+        totals = [0, 0, 0]
+        for proc in procs:
+            out, _ = proc.communicate()
+            line = next(line for line in out.splitlines() if line.startswith("RESULT"))
+            for i, value in enumerate(line.split()[1:]):
+                totals[i] += int(value)
+        return totals[0], totals[1], totals[2]
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "seed":
+        seed(os.environ["DATABASE_URL"])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "write":
+        run_writer(int(sys.argv[2]), float(sys.argv[3]))
+        return
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+    print(f"{processes} process x {threads} thread, {duration:.0f}s mỗi profile")
+    for name, tuned in (("mặc định", False), ("tuned", True)):
+        commits, locked, other = run_profile(tuned, processes, threads, duration)
+        print(f"{name:>9}: {commits / duration:8.1f} commit/s, {locked} lần 'database is locked', {other} lỗi khác")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Đo thời gian khởi động và RSS của một worker khi `import app`.
+
+Mỗi lần đo chạy trong process mới với `python -X importtime`, in tổng thời gian,
+RSS sau khi import và các package tốn thời gian nhất (cộng dồn).
+Kèm theo danh sách thư viện nặng đã bị nạp sẵn (lý tưởng là không có).
+
+Chạy: python bench/bench_startup.py [số_lần] [số_package_top]
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+HEAVY = ("pandas", "numpy", "openpyxl", "openai", "googleapiclient.discovery", "google_auth_oauthlib")
+
+_PROBE = (
+    "import resource, sys, time\n"
+    "t0 = time.perf_counter()\n"
+    "import app\n"
+    "elapsed = time.perf_counter() - t0\n"
+    "rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024\n"
+    f"heavy = [m for m in {HEAVY!r} if m in sys.modules]\n"
+    "print(f'RESULT {elapsed:.4f} {rss:.1f} {\",\".join(heavy)}')\n"
+)
+
+
+def run_once() -> tuple[float, float, list[str], list[tuple[int, str]]]:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    modules = []
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            cumulative = int(parts[1])
+        except ValueError:
+            continue
+        modules.append((cumulative, parts[2].strip()))
+    result = next(line for line in proc.stdout.splitlines() if line.startswith("RESULT"))
+    _, elapsed, rss, *heavy = result.split(" ")
+    loaded = heavy[0].split(",") if heavy and heavy[0] else []
+    return float(elapsed), float(rss), loaded, modules
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    top = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    samples = [run_once() for _ in range(runs)]
+    elapsed = [s[0] for s in samples]
+    rss = [s[1] for s in samples]
+    print(f"import app: trung vị {statistics.median(elapsed) * 1000:.0f} ms "
+          f"(min {min(elapsed) * 1000:.0f}, max {max(elapsed) * 1000:.0f}), "
+          f"RSS {statistics.median(rss):.0f} MB, {runs} lần")
+    loaded = samples[-1][2]
+    print(f"Thư viện nặng đã nạp: {', '.join(loaded) if loaded else 'không có'}")
+    # Gộp theo package gốc, lấy thời gian cộng dồn lớn nhất để khỏi đếm trùng module con
+    packages: dict[str, int] = {}
+    for cumulative, name in samples[-1][3]:
+        package = name.split(".")[0]
+        if package not in ("app", "site", "encodings"):
+            packages[package] = max(packages.get(package, 0), cumulative)
+    print(f"Top {top} package (cộng dồn, lần đo cuối):")
+    for name, cumulative in sorted(packages.items(), key=lambda kv: kv[1], reverse=True)[:top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""So sánh import tuần tự (1 request/dòng) với import theo batch.
+
+Hai dòng đầu tắt bộ giới hạn phía client để chỉ đo số round trip. Dòng cuối chạy lại
+import batch trong process con với CALENDAR_USER_QPS/CALENDAR_PROJECT_QPS mặc định:
+khi đó tốc độ bị chặn bởi quota (mặc định 10 request/giây mỗi user), nên lợi ích của
+batch chỉ còn ở số HTTP request chứ không còn ở thời gian import.
+
+Chạy: python bench/bench_upload_batch.py [số_dòng] [độ_trễ_giây]
+"""
+import os
+import subprocess
+import sys
+import time
+
+LIMITED = sys.argv[1:2] == ["limited"]
+QUOTA_ENV = ("CALENDAR_USER_QPS", "CALENDAR_PROJECT_QPS")
+if not LIMITED:
+    for name in QUOTA_ENV:
+        os.environ.setdefault(name, "100000")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fake_google import FakeCalendar, calendar_service, serve  # noqa: E402
+
+from app import insert_events_batched  # noqa: E402
+
+
+def make_events(n: int) -> list[dict]:
+    tz = "Asia/Ho_Chi_Minh"
+    return [
+        {
+            "summary": f"Ôn tập {i}",
+            "start": {"dateTime": f"2025-10-20T08:{i % 60:02d}:00", "timeZone": tz},
+            "end": {"dateTime": f"2025-10-20T09:{i % 60:02d}:00", "timeZone": tz},
+            "reminders": {"useDefault": False, "overrides": [{"method": "popup", "minutes": 15}]},
+        }
+        for i in range(n)
+    ]
+
+
+def serial_insert(service, events: list[dict]) -> tuple[int, int]:
+    successes, failures = 0, 0
+    for event in events:
+        try:
+            service.events().insert(calendarId="primary", body=event).execute()
+            successes += 1
+        except Exception:
+            failures += 1
+    return successes, failures
+
+
+def run_case(name: str, fn, rows: int, latency: float):
+    events = make_events(rows)
+    calendar = FakeCalendar(latency=latency)
+    server = serve(calendar)
+    service = calendar_service("http://%s:%d" % server.server_address)
+    t0 = time.perf_counter()
+    ok, fail = fn(service, events)
+    elapsed = time.perf_counter() - t0
+    server.shutdown()
+    print(f"{name:>12}: {rows} dòng, {calendar.http_requests} HTTP request, "
+          f"{elapsed:.2f}s (thành công {ok}, lỗi {fail})", flush=True)
+
+
+def main():
+    if LIMITED:
+        run_case("batch+quota", insert_events_batched, int(sys.argv[2]), float(sys.argv[3]))
+        return
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+    for name, fn in (("tuần tự", serial_insert), ("batch", insert_events_batched)):
+        run_case(name, fn, rows, latency)
+    # Process con đọc lại cấu hình quota mặc định của app
+    env = {k: v for k, v in os.environ.items() if k not in QUOTA_ENV}
+    subprocess.run([sys.executable, __file__, "limited", str(rows), str(latency)], env=env, check=True)
+
+
+if __name__ == "__main__":
+    main()
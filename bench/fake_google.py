@@ -0,0 +1,280 @@
+"""Máy chủ Google Calendar/OAuth giả lập chạy local, dùng cho benchmark và load test.
+
+Chỉ cài đặt phần app.py dùng:
+- Calendar v3: events.list (có syncToken), events.insert, events.patch và endpoint batch (multipart/mixed)
+- OAuth: POST /token (authorization_code, refresh_token) và GET /oauth2/v2/userinfo
+
+Mỗi HTTP round trip bị trễ `latency` giây để mô phỏng mạng tới Google. Lời gọi Calendar bị
+trả 429 khi vượt `quota_per_second` hoặc ngẫu nhiên với xác suất `error_rate`.
+Lịch được tách theo access token: code OAuth chính là email của user giả.
+
+Chạy độc lập: python bench/fake_google.py [--port 8765] [--latency 0.02] [--quota 0] [--error-rate 0]
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EVENTS_PATH = "/calendar/v3/calendars/primary/events"
+BATCH_PATH = "/batch/calendar/v3"
+TOKEN_PATH = "/token"
+USERINFO_PATH = "/oauth2/v2/userinfo"
+STATS_PATH = "/_fake/stats"
+
+RATE_LIMITED = {"error": {"code": 429, "message": "Rate Limit Exceeded",
+                          "errors": [{"reason": "rateLimitExceeded"}]}}
+
+
+class FakeCalendar:
+    def __init__(self, latency: float = 0.02, quota_per_second: float | None = None,
+                 error_rate: float = 0.0, token_ttl: int = 3600):
+        self.latency = latency
+        # Vượt quá số lời gọi API mỗi giây này thì trả 429 như quota của Google
+        self.quota_per_second = quota_per_second
+        # Xác suất trả 429 ngẫu nhiên cho mỗi lời gọi Calendar (kể cả từng phần trong batch)
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        self.events: dict[str, dict] = {}
+        # Theo từng chủ lịch: số thứ tự thay đổi của từng event, dùng làm syncToken
+        self._changed: dict[str, dict[str, int]] = {}
+        self._seq = 0
+        # access token -> email; request không có token dùng chung lịch ""
+        self.tokens: dict[str, str] = {}
+        self.http_requests = 0
+        self.rate_limited = 0
+        self.injected_errors = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._window = (0, 0)
+
+    def _over_quota(self) -> bool:
+        if self.error_rate and random.random() < self.error_rate:
+            with self._lock:
+                self.injected_errors += 1
+            return True
+        if self.quota_per_second is None:
+            return False
+        with self._lock:
+            second, count = self._window
+            now = int(time.monotonic())
+            count = count + 1 if now == second else 1
+            self._window = (now, count)
+            if count > self.quota_per_second:
+                self.rate_limited += 1
+                return True
+        return False
+
+    def owner(self, authorization: str | None) -> str:
+        token = (authorization or "").partition(" ")[2]
+        return self.tokens.get(token, "")
+
+    def insert(self, body: dict, owner: str = "") -> tuple[int, dict]:
+        if not body.get("summary") or "start" not in body or "end" not in body:
+            return 400, {"error": {"code": 400, "message": "Missing required field"}}
+        with self._lock:
+            event_id = f"evt{next(self._ids)}"
+            event = dict(body, id=event_id, status="confirmed")
+            self.events[event_id] = event
+            self._touch(owner, event_id)
+        return 200, event
+
+    def _touch(self, owner: str, event_id: str):
+        self._seq += 1
+        self._changed.setdefault(owner, {})[event_id] = self._seq
+
+    def list(self, query: dict, owner: str = "") -> tuple[int, dict]:
+        since = int(query.get("syncToken", 0))
+        offset = int(query.get("pageToken", 0))
+        limit = int(query.get("maxResults", 250))
+        with self._lock:
+            mine = self._changed.get(owner, {})
+            changed = sorted((seq, eid) for eid, seq in mine.items() if seq > since)
+            page = [dict(self.events[eid]) for _, eid in changed[offset:offset + limit]]
+            result = {"kind": "calendar#events", "items": page}
+            if offset + limit < len(changed):
+                result["nextPageToken"] = str(offset + limit)
+            else:
+                result["nextSyncToken"] = str(self._seq)
+        return 200, result
+
+    def patch(self, event_id: str, body: dict, owner: str = "") -> tuple[int, dict]:
+        with self._lock:
+            if event_id not in self._changed.get(owner, {}):
+                return 404, {"error": {"code": 404, "message": "Not Found"}}
+            self.events[event_id].update(body)
+            self._touch(owner, event_id)
+            return 200, dict(self.events[event_id])
+
+    def token(self, form: dict) -> tuple[int, dict]:
+        grant = form.get("grant_type")
+        if grant == "authorization_code":
+            email = form.get("code", "")
+        elif grant == "refresh_token":
+            email = form.get("refresh_token", "").removeprefix("refresh-")
+        else:
+            return 400, {"error": "unsupported_grant_type"}
+        if "@" not in email:
+            return 400, {"error": "invalid_grant"}
+        access_token = f"fake-{uuid.uuid4().hex}"
+        with self._lock:
+            self.tokens[access_token] = email
+        return 200, {"access_token": access_token, "token_type": "Bearer",
+                     "expires_in": self.token_ttl, "refresh_token": f"refresh-{email}"}
+
+    def userinfo(self, owner: str) -> tuple[int, dict]:
+        if not owner:
+            return 401, {"error": {"code": 401, "message": "Invalid Credentials"}}
+        return 200, {"id": str(abs(hash(owner))), "email": owner, "verified_email": True}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"http_requests": self.http_requests, "rate_limited": self.rate_limited,
+                    "injected_errors": self.injected_errors, "events": len(self.events),
+                    "users": len(set(self.tokens.values()))}
+
+    def dispatch(self, method: str, path: str, body: bytes, owner: str = "") -> tuple[int, dict]:
+        path, _, query = path.partition("?")
+        if path == STATS_PATH:
+            return 200, self.stats()
+        if method == "POST" and path == TOKEN_PATH:
+            return self.token(dict(urllib.parse.parse_qsl(body.decode())))
+        if method == "GET" and path == USERINFO_PATH:
+            return self.userinfo(owner)
+        # Quota và lỗi ngẫu nhiên chỉ áp cho Calendar, đăng nhập luôn thành công
+        if self._over_quota():
+            return 429, RATE_LIMITED
+        if method == "GET" and path == EVENTS_PATH:
+            return self.list(dict(urllib.parse.parse_qsl(query)), owner)
+        if method == "POST" and path == EVENTS_PATH:
+            return self.insert(json.loads(body or b"{}"), owner)
+        if method == "PATCH" and path.startswith(EVENTS_PATH + "/"):
+            return self.patch(path[len(EVENTS_PATH) + 1:], json.loads(body or b"{}"), owner)
+        return 404, {"error": {"code": 404, "message": f"Not found: {method} {path}"}}
+
+
+def _batch_response(calendar: FakeCalendar, content_type: str, body: bytes, owner: str) -> tuple[str, bytes]:
+    message = BytesParser(policy=HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+    )
+    boundary = "batch_fake_google"
+    out = []
+    for part in message.iter_parts():
+        content_id = part["Content-ID"].strip("<>")
+        raw = part.get_payload(decode=True) or b""
+        head, _, sub_body = raw.partition(b"\r\n\r\n")
+        if not sub_body and b"\n\n" in raw:
+            head, _, sub_body = raw.partition(b"\n\n")
+        request_line = head.splitlines()[0].decode()
+        method, uri = request_line.split(" ")[:2]
+        path = "/" + uri.split("://", 1)[-1].split("/", 1)[-1]
+        status, payload = calendar.dispatch(method, path, sub_body, owner)
+        out.append(
+            f"--{boundary}\r\n"
+            "Content-Type: application/http\r\n"
+            f"Content-ID: <response-{content_id}>\r\n\r\n"
+            f"HTTP/1.1 {status} {'OK' if status < 300 else 'Error'}\r\n"
+            "Content-Type: application/json; charset=UTF-8\r\n\r\n"
+            f"{json.dumps(payload)}\r\n"
+        )
+    out.append(f"--{boundary}--\r\n")
+    return f"multipart/mixed; boundary={boundary}", "".join(out).encode()
+
+
+def make_handler(calendar: FakeCalendar):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, content_type: str, body: bytes):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _handle(self, method: str):
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length) if length else b""
+            if not self.path.startswith(STATS_PATH):
+                with calendar._lock:
+                    calendar.http_requests += 1
+                time.sleep(calendar.latency)
+            owner = calendar.owner(self.headers.get("Authorization"))
+            if method == "POST" and self.path.split("?", 1)[0] == BATCH_PATH:
+                content_type, payload = _batch_response(calendar, self.headers["Content-Type"], body, owner)
+                self._send(200, content_type, payload)
+                return
+            status, payload = calendar.dispatch(method, self.path, body, owner)
+            self._send(status, "application/json", json.dumps(payload).encode())
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_PATCH(self):
+            self._handle("PATCH")
+
+        def do_POST(self):
+            self._handle("POST")
+
+    return Handler
+
+
+def serve(calendar: FakeCalendar, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Chạy server trong thread nền, trả về server (xem `server_address`)."""
+    server = ThreadingHTTPServer((host, port), make_handler(calendar))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def client_config(base_url: str) -> dict:
+    """Nội dung credentials.json trỏ endpoint OAuth vào server giả."""
+    base_url = base_url.rstrip("/")
+    return {"web": {
+        "client_id": "fake-client.apps.googleusercontent.com",
+        "client_secret": "fake-secret",
+        "auth_uri": f"{base_url}/o/oauth2/auth",
+        "token_uri": f"{base_url}{TOKEN_PATH}",
+    }}
+
+
+def calendar_service(base_url: str):
+    """Tạo service Calendar v3 trỏ vào server giả (kể cả endpoint batch)."""
+    import httplib2
+    from googleapiclient.discovery import build_from_document
+    from googleapiclient.discovery_cache import get_static_doc
+
+    doc = json.loads(get_static_doc("calendar", "v3"))
+    doc["rootUrl"] = base_url.rstrip("/") + "/"
+    return build_from_document(doc, http=httplib2.Http())
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Máy chủ Google Calendar/OAuth giả")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.02, help="giây trễ mỗi round trip")
+    ap.add_argument("--quota", type=float, default=0, help="số lời gọi/giây trước khi trả 429 (0 = không giới hạn)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="xác suất 429 ngẫu nhiên mỗi lời gọi")
+    args = ap.parse_args()
+    calendar = FakeCalendar(latency=args.latency, quota_per_second=args.quota or None, error_rate=args.error_rate)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(calendar))
+    server.daemon_threads = True
+    print(f"Fake Google tại http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Load test end-to-end: gunicorn chạy app.py, mọi lời gọi Google đi vào bench/fake_google.py.
+
+Các bước:
+1. Chạy fake Google (subprocess) với độ trễ/429 cấu hình được
+2. Tạo thư mục tạm chứa credentials.json trỏ vào fake và DB SQLite riêng
+3. Chạy gunicorn với số worker/thread cho trước, GOOGLE_API_ROOT trỏ vào fake
+4. Mỗi user ảo đăng nhập qua /authorize + /oauth2callback rồi gửi request
+   theo tỉ lệ route trong `--mix` cho tới hết `--duration`
+5. In RPS và p50/p95/p99 theo từng route
+
+Chạy: python bench/loadtest.py --workers 2 --threads 4 --users 20 --duration 30
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_google import client_config  # noqa: E402
+
+DEFAULT_MIX = "dashboard=6,add_event=2,upload=1,healthz=1"
+UPLOAD_CSV = (
+    "ngày,tháng,năm,giờ,nội dung nhắc nhở,thời gian nhắc nhở,thời gian kết thúc\n"
+    + "".join(f"{1 + i % 28},11,2025,{7 + i % 10:02d}:00,Ôn tập {i},15,{8 + i % 10:02d}:00\n" for i in range(20))
+).encode("utf-8")
+
+
+class Client:
+    """Một user ảo. Cookie session của app có cờ Secure nên tự gửi lại qua HTTP."""
+
+    def __init__(self, base_url: str, email: str):
+        self.base_url = base_url
+        self.email = email
+        self.http = requests.Session()
+        self.cookie = ""
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        headers = {"Cookie": self.cookie} if self.cookie else {}
+        resp = self.http.request(method, self.base_url + path, headers=headers,
+                                 allow_redirects=False, timeout=60, **kwargs)
+        value = resp.cookies.get("session")
+        if value:
+            self.cookie = f"session={value}"
+        return resp
+
+    def login(self):
+        resp = self.request("GET", "/authorize")
+        state = urllib.parse.parse_qs(urllib.parse.urlparse(resp.headers["Location"]).query)["state"][0]
+        query = urllib.parse.urlencode({"state": state, "code": self.email})
+        self.request("GET", f"/oauth2callback?{query}")
+
+    def dashboard(self):
+        return self.request("GET", "/")
+
+    def add_event(self):
+        day = random.randint(1, 28)
+        return self.request("POST", "/add_event", data={
+            "title": f"Học nhóm {random.randint(1, 999)}", "date": f"2025-11-{day:02d}",
+            "start_time": "14:00", "end_time": "15:00",
+        })
+
+    def upload(self):
+        return self.request("POST", "/upload", files={"file": ("lich.csv", UPLOAD_CSV, "text/csv")})
+
+    def healthz(self):
+        return self.request("GET", "/healthz")
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def wait_http(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} không phản hồi sau {timeout}s")
+
+
+def parse_mix(text: str) -> list[tuple[str, int]]:
+    mix = []
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if not hasattr(Client, name):
+            raise SystemExit(f"Route không hỗ trợ: {name}")
+        mix.append((name, int(weight or 1)))
+    return mix
+
+
+def run_users(base_url: str, users: int, duration: float, mix: list[tuple[str, int]]):
+    clients = [Client(base_url, f"student{i}@example.com") for i in range(users)]
+    for client in clients:
+        client.login()
+    samples: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+    lock = threading.Lock()
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    deadline = time.monotonic() + duration
+
+    def loop(client: Client):
+        while time.monotonic() < deadline:
+            route = random.choices(names, weights)[0]
+            t0 = time.perf_counter()
+            try:
+                ok = getattr(client, route)().status_code < 400
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - t0
+            with lock:
+                samples[route].append(elapsed)
+                if not ok:
+                    errors[route] += 1
+
+    threads = [threading.Thread(target=loop, args=(c,)) for c in clients]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, errors, time.perf_counter() - t0
+
+
+def report(samples: dict[str, list[float]], errors: dict[str, int], wall: float):
+    print(f"{'route':>10} {'số req':>7} {'RPS':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'lỗi':>5}")
+    total = 0
+    for route in sorted(samples):
+        values = samples[route]
+        total += len(values)
+        print(f"{route:>10} {len(values):>7} {len(values) / wall:>7.1f} {percentile(values, 50) * 1000:>8.1f} "
+              f"{percentile(values, 95) * 1000:>8.1f} {percentile(values, 99) * 1000:>8.1f} {errors[route]:>5}")
+    print(f"{'tổng':>10} {total:>7} {total / wall:>7.1f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load test app.py với fake Google")
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--threads", type=int, default=4)
+    ap.add_argument("--users", type=int, default=20)
+    ap.add_argument("--duration", type=float, default=30)
+    ap.add_argument("--mix", default=DEFAULT_MIX, help=f"route=trọng_số, mặc định {DEFAULT_MIX}")
+    ap.add_argument("--latency", type=float, default=0.05, help="độ trễ fake Google (giây)")
+    ap.add_argument("--quota", type=float, default=0, help="quota fake Google mỗi giây (0 = không giới hạn)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="xác suất 429 ngẫu nhiên của fake Google")
+    ap.add_argument("--app-port", type=int, default=8123)
+    ap.add_argument("--google-port", type=int, default=8765)
+    args = ap.parse_args()
+    mix = parse_mix(args.mix)
+
+    google_url = f"http://127.0.0.1:{args.google_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    procs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "credentials.json"), "w") as f:
+            json.dump(client_config(google_url), f)
+        env = dict(
+            os.environ,
+            PYTHONPATH=ROOT,
+            DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'loadtest.db')}",
+            GOOGLE_API_ROOT=google_url,
+            # app chia pool DB và quota Calendar theo số worker/thread nên phải khớp với cờ gunicorn
+            WEB_CONCURRENCY=str(args.workers),
+            WEB_THREADS=str(args.threads),
+        )
+        try:
+            procs.append(subprocess.Popen(
+                [sys.executable, os.path.join(ROOT, "bench", "fake_google.py"), "--port", str(args.google_port),
+                 "--latency", str(args.latency), "--quota", str(args.quota), "--error-rate", str(args.error_rate)],
+                stdout=subprocess.DEVNULL,
+            ))
+            subprocess.run([sys.executable, "-c", "from app import app, db\nwith app.app_context(): db.create_all()"],
+                           cwd=tmp, env=env, check=True, stdout=subprocess.DEVNULL)
+            procs.append(subprocess.Popen(
+                [sys.executable, "-m", "gunicorn", "-w", str(args.workers), "--threads", str(args.threads),
+                 "-b", f"127.0.0.1:{args.app_port}", "--log-level", "warning", "app:app"],
+                cwd=tmp, env=env, stdout=subprocess.DEVNULL,
+            ))
+            wait_http(f"{google_url}/_fake/stats")
+            wait_http(f"{app_url}/healthz")
+            print(f"gunicorn {args.workers} worker x {args.threads} thread, {args.users} user, {args.duration:.0f}s, "
+                  f"Google trễ {args.latency * 1000:.0f} ms, 429 ngẫu nhiên {args.error_rate:.0%}")
+            samples, errors, wall = run_users(app_url, args.users, args.duration, mix)
+            report(samples, errors, wall)
+            stats = requests.get(f"{google_url}/_fake/stats", timeout=5).json()
+            print("fake Google: " + ", ".join(f"{k}={v}" for k, v in stats.items()))
+        finally:
+            for proc in reversed(procs):
+                proc.send_signal(signal.SIGTERM)
+                proc.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""Cấu hình gunicorn (gunicorn tự đọc file này khi chạy từ thư mục repo).
+
+Bật chế độ multiprocess của prometheus_client để /metrics gộp số liệu của mọi worker,
+và lấy số worker/thread từ WEB_CONCURRENCY/WEB_THREADS.
+"""
+import glob
+import os
+import tempfile
+
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "student_coach_metrics"))
+# Với --preload, app.py được import (và tạo file số liệu) trước on_starting nên thư mục phải có sẵn ngay
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+# app.py đọc cùng các biến này để chia pool kết nối Postgres theo số worker
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+threads = int(os.getenv("WEB_THREADS", "1"))
+
+
+def on_starting(server):
+    # Số liệu của lần chạy trước không còn ý nghĩa. Chỉ dọn ở đây (không dọn lúc đọc file cấu hình)
+    # vì SIGHUP đọc lại file cấu hình trong khi worker vẫn đang ghi. File master tạo lúc preload
+    # bị xoá theo cũng không sao: worker fork ra đổi pid nên tự tạo file mới.
+    # Chỉ xoá file *.db của prometheus_client, không xoá cả thư mục: biến môi trường có thể
+    # trỏ vào một thư mục dùng chung chứa file khác.
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(path, exist_ok=True)
+    for name in glob.glob(os.path.join(path, "*.db")):
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,5 +1,6 @@
 import os
 import io
+import json
 import pickle
 import pandas as pd
 from datetime import date, timedelta, datetime
@@ -65,10 +66,24 @@ class ImportLog(db.Model):
 # =========================
 # 🔑 GOOGLE AUTH HELPER
 # =========================
+_client_config_cache = {"mtime": None, "config": None}
+
+def load_client_config():
+    """Đọc credentials.json một lần, chỉ đọc lại khi mtime của file thay đổi."""
+    try:
+        mtime = os.stat(CREDENTIALS_FILE).st_mtime_ns
+    except OSError:
+        return _client_config_cache["config"]
+    if mtime != _client_config_cache["mtime"]:
+        with open(CREDENTIALS_FILE, encoding="utf-8") as f:
+            _client_config_cache["config"] = json.load(f)
+        _client_config_cache["mtime"] = mtime
+    return _client_config_cache["config"]
+
 def build_flow(redirect_uri: str, state: str | None = None):
     if not GOOGLE_ENABLED:
         return None
-    flow = Flow.from_client_secrets_file(CREDENTIALS_FILE, scopes=SCOPES, redirect_uri=redirect_uri)
+    flow = Flow.from_client_config(load_client_config(), scopes=SCOPES, redirect_uri=redirect_uri)
     if state:
         flow.oauth2session._state = state
     return flow
@@ -193,13 +208,8 @@ def authorize():
     host = os.getenv("PUBLIC_BASE_URL") or request.host_url.rstrip("/")
     redirect_uri = f"{host}/oauth2callback"
 
-    # Tạo flow mới mỗi lần (tránh lỗi state cũ)
-    from google_auth_oauthlib.flow import Flow
-    flow = Flow.from_client_secrets_file(
-        CREDENTIALS_FILE,
-        scopes=SCOPES,
-        redirect_uri=redirect_uri
-    )
+    # Tạo flow mới mỗi lần (tránh lỗi state cũ); client config lấy từ bộ nhớ
+    flow = build_flow(redirect_uri)
 
     # 🧩 Xóa token cũ nếu scope đã đổi (tự động)
     email = session.get("google_email")
@@ -207,7 +217,6 @@ def authorize():
         token_file = get_token_filename(email)
         if os.path.exists(token_file):
             try:
-                import pickle
                 with open(token_file, "rb") as f:
                     creds = pickle.load(f)
                 # So sánh scope hiện tại của creds với SCOPES trong app